@@ -1,353 +1,2702 @@
-import pychromecast
-import pandas as pd
-import time
+import argparse
+import asyncio
+import atexit
+import configparser
+import csv
+import ctypes
+import ctypes.util
+import hashlib
+import json
 import logging
-from datetime import datetime, timedelta
+import math
+import mimetypes
+import mmap
 import os
+import queue
 import random
+import select
+import shutil
+import signal
+import socket
+import struct
+import subprocess
 import sys
-from logging.handlers import RotatingFileHandler
-import zeroconf
-from mutagen.easyid3 import EasyID3  # New import for MP3 metadata
-import configparser
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from email.utils import formatdate
+from functools import lru_cache, partial
+from itertools import islice
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from urllib.parse import quote, unquote, urlsplit
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+# pychromecast/zeroconf, mutagen, praytimes and hijridate are imported where
+# first used, so loading the script stays cheap (see tools/startup_benchmark.py).
 
 # ================================
 # Configuration File and Loading
 # ================================
-CONFIG_FILE = '/etc/athan-automation/config.ini'
+CONFIG_FILE = os.environ.get('ATHAN_AUTOMATION_CONFIG', '/etc/athan-automation/config.ini')
     
-def load_config():
+def site_configs(config):
     """
-    Load configuration values from the ini file.
-    Logs an error if the file is missing but continues with default values.
+    Returns {site name: settings} for every site served by this process:
+    the named sections of a multi-site config, or the single unnamed site ''.
     """
-    cp = configparser.ConfigParser()
-    if not cp.read(CONFIG_FILE):  
-        logging.error(f"Configuration file not found: {CONFIG_FILE}. Using default values.")
+    return config['SITES'] or {'': config}
+
+
+def site_label(config):
+    """Log prefix naming the site in multi-site mode."""
+    return f"[{config['SITE']}] " if config['SITE'] else ''
 
-    section = cp['DEFAULT']
 
-    settings = {
+def parse_device_list(value):
+    """
+    Splits a comma-separated list of Chromecast friendly names.
+    """
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+def read_settings(section, site=''):
+    """
+    Returns the settings dict for one config section. Named sections inherit
+    every value they do not set from [DEFAULT].
+    """
+    return {
+        'SITE': site,
         'FAJR_FOLDER': section.get('FAJR_FOLDER', '/var/www/html/athan/fajr'),
         'PRAYER_FOLDER': section.get('PRAYER_FOLDER', '/var/www/html/athan/prayer'),
         'IFTAR_FOLDER': section.get('IFTAR_FOLDER', '/var/www/html/athan/iftar'),
-        'PRAYER_TIMES_FILE': os.path.expanduser(section.get('PRAYER_TIMES_FILE')),
+        'SCHEDULE_SOURCE': section.get('SCHEDULE_SOURCE', 'csv').strip().lower(),
+        'PRAYER_TIMES_FILE': os.path.expanduser(section.get('PRAYER_TIMES_FILE', '/var/lib/athan-automation/prayer_times.csv')),
+        'LATITUDE': section.getfloat('LATITUDE', None),
+        'LONGITUDE': section.getfloat('LONGITUDE', None),
+        'CALCULATION_METHOD': section.get('CALCULATION_METHOD', 'mwl').strip().lower(),
+        'ASR_METHOD': section.get('ASR_METHOD', 'standard').strip().lower(),
+        'TIMEZONE': section.get('TIMEZONE', '').strip(),
         'LIGHTTPD_BASE_URL': section.get('LIGHTTPD_BASE_URL', "http://192.168.86.30/html/athan"),
         'ATHAN_ART_URL': section.get('ATHAN_ART_URL', "http://192.168.86.30/html/athan/Mohamed_Ali_Mosque.jpg"),
         'IFTAR_ART_URL': section.get('IFTAR_ART_URL', "http://192.168.86.30/html/athan/Iftar.jpg"),
-        'ATHAN_DEVICE': section.get('ATHAN_DEVICE'),
-        'IFTAR_DEVICE': section.get('IFTAR_DEVICE', 'All speakers'),
+        'MEDIA_SERVER_PORT': section.getint('MEDIA_SERVER_PORT', 0),
+        'MEDIA_SERVER_URL': section.get('MEDIA_SERVER_URL', '').rstrip('/'),
+        'ARTWORK_FOLDER': section.get('ARTWORK_FOLDER', '/var/www/html/athan'),
+        'MEDIA_CACHE_MB': section.getint('MEDIA_CACHE_MB', 32),
+        'TRANSCODE_AUDIO': section.getboolean('TRANSCODE_AUDIO', False),
+        'TRANSCODE_FOLDER': section.get('TRANSCODE_FOLDER', '/var/www/html/athan/cache'),
+        'TRANSCODE_BITRATE': section.get('TRANSCODE_BITRATE', '128k').strip(),
+        'LOUDNESS_TARGET': section.getfloat('LOUDNESS_TARGET', -16.0),
+        'FFMPEG_PATH': section.get('FFMPEG_PATH', 'ffmpeg'),
+        'ATHAN_DEVICE': parse_device_list(section.get('ATHAN_DEVICE')),
+        'IFTAR_DEVICE': parse_device_list(section.get('IFTAR_DEVICE', 'All speakers')),
         'LOG_FILE': os.path.expanduser(section.get('LOG_FILE')),
+        'LOG_FORMAT': section.get('LOG_FORMAT', 'text').strip().lower(),
         'ATHAN_VOLUME_LEVEL': section.getfloat('ATHAN_VOLUME_LEVEL', 0.3),
         'FAJR_VOLUME_LEVEL': section.getfloat('FAJR_VOLUME_LEVEL', 0.2),
-    }  # ✅ Added missing commas at the end of each line
+        'PREWARM_SECONDS': section.getint('PREWARM_SECONDS', 60),
+        'PRELOAD_MEDIA': section.getboolean('PRELOAD_MEDIA', False),
+        'DEVICE_TIMEOUT': section.getfloat('DEVICE_TIMEOUT', 15),
+        'SKEW_BUDGET_MS': section.getint('SKEW_BUDGET_MS', 250),
+        'MAX_PLAYBACK_SECONDS': section.getfloat('MAX_PLAYBACK_SECONDS', 600),
+        'METRICS_PORT': section.getint('METRICS_PORT', 0),
+        'METRICS_HOST': section.get('METRICS_HOST', '127.0.0.1'),
+        'EVENT_LOG_FILE': os.path.expanduser(section.get('EVENT_LOG_FILE', '/var/log/athan-automation/events.jsonl')),
+        'DEVICE_CACHE_FILE': os.path.expanduser(section.get('DEVICE_CACHE_FILE', '/var/lib/athan-automation/devices.json')),
+        'CONTROL_SOCKET': os.path.expanduser(section.get('CONTROL_SOCKET', '/run/athan-automation/control.sock')),
+    }
+
+
+def load_config():
+    """
+    Load configuration values from the ini file.
+    Logs an error if the file is missing but continues with default values.
+    [DEFAULT] holds the process-wide settings; each named section, if any,
+    is a separate site (see site_configs()).
+    """
+    cp = configparser.ConfigParser()
+    if not cp.read(CONFIG_FILE):  
+        logging.error(f"Configuration file not found: {CONFIG_FILE}. Using default values.")
+
+    settings = read_settings(cp['DEFAULT'])
+    settings['SITES'] = {name: read_settings(cp[name], name) for name in cp.sections()}
 
     # Log a warning if the prayer times file is missing
-    if not os.path.exists(settings['PRAYER_TIMES_FILE']):
-        logging.warning(f"Prayer times file not found: {settings['PRAYER_TIMES_FILE']}.")
+    for site_config in site_configs(settings).values():
+        if site_config['SCHEDULE_SOURCE'] == 'csv' and not os.path.exists(site_config['PRAYER_TIMES_FILE']):
+            logging.warning(f"Prayer times file not found: {site_config['PRAYER_TIMES_FILE']}.")
 
     last_mtime = os.stat(CONFIG_FILE).st_mtime if os.path.exists(CONFIG_FILE) else None
     return settings, last_mtime
 
 
-current_config, last_mtime = load_config()
-
 max_retries = 3 # discovery retries
-retry_delay = 5  # seconds between retries
+retry_delay = 5  # seconds to wait for a device to appear in the registry per attempt
+direct_connect_timeout = 3  # seconds for connecting to a device's cached address
 
 # ========================
 # Logging Configuration
 # ========================
-# (We use the LOG_FILE from the config when first loaded.)
+# Records are put on a queue by the logging calls and written to LOG_FILE by
+# a background thread, so a slow SD card or a log rotation never delays the
+# cast path. (We use the LOG_FILE from the config when first loaded.)
 current_config, last_mtime = load_config()
 max_log_size = 5 * 1024 * 1024  # 5 MB
 backup_count = 3  # Number of log backups to keep
+LOG_LINE_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
 
-logging.basicConfig(
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    encoding="utf-8",
-    level=logging.INFO,
-    handlers=[
-        RotatingFileHandler(
-            current_config['LOG_FILE'], maxBytes=max_log_size, backupCount=backup_count
-        )
-    ],
-)
 
-def check_and_reload_config():
+class JsonLogFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line (LOG_FORMAT = json)."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).astimezone().isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),  # Includes any traceback (see QueueHandler.prepare)
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+HandlerSwitch = namedtuple('HandlerSwitch', 'handler')
+
+
+class LogWriter(QueueListener):
+    """
+    Background thread writing queued log records to the file handler.
+    The handler is replaced in-band: a HandlerSwitch put on the queue takes
+    effect between two records, so records logged before a reload land in
+    the old file and later ones in the new file, none dropped or duplicated.
+    """
+
+    def handle(self, record):
+        if isinstance(record, HandlerSwitch):
+            previous, self.handlers = self.handlers, (record.handler,)
+            for handler in previous:
+                handler.close()
+            return
+        super().handle(record)
+
+    def switch_to(self, handler):
+        self.queue.put_nowait(HandlerSwitch(handler))
+
+    def stop(self):
+        """Writes out the queued records and stops the thread; safe to call more than once."""
+        if self._thread is not None:
+            super().stop()
+
+
+def make_log_handler(config):
+    """Returns the rotating file handler for LOG_FILE in the configured LOG_FORMAT."""
+    handler = RotatingFileHandler(config['LOG_FILE'], maxBytes=max_log_size, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(JsonLogFormatter() if config['LOG_FORMAT'] == 'json' else logging.Formatter(LOG_LINE_FORMAT))
+    return handler
+
+
+log_queue = queue.SimpleQueue()
+log_writer = LogWriter(log_queue, make_log_handler(current_config))
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))  # The file handler adds time and level
+# force: warnings logged while loading the config may already have set up a default handler
+logging.basicConfig(level=logging.INFO, handlers=[queue_handler], force=True)
+log_writer.start()
+atexit.register(log_writer.stop)  # Writes out whatever is still queued (SIGTERM: see run_daemon())
+
+def check_and_reload_config(force=False):
     global current_config, last_mtime
     if not os.path.exists(CONFIG_FILE):
         return
     current_mtime = os.stat(CONFIG_FILE).st_mtime
-    if current_mtime != last_mtime:
+    if current_mtime != last_mtime or force:
         try:
             new_config, new_last_mtime = load_config()
-            # Check if log file changed
-            if new_config['LOG_FILE'] != current_config['LOG_FILE']:
-                setup_logging(new_config['LOG_FILE'])
+            # Check if log file or format changed
+            if (new_config['LOG_FILE'], new_config['LOG_FORMAT']) != (current_config['LOG_FILE'], current_config['LOG_FORMAT']):
+                setup_logging(new_config)
+            changed_keys = [key for key in new_config if new_config[key] != current_config.get(key)]
             current_config = new_config
             last_mtime = new_last_mtime
-            logging.info("Configuration reloaded due to file change.")
+            reason = 'on request' if force else 'due to file change'
+            logging.info(f"Configuration reloaded {reason}: {', '.join(changed_keys) or 'no setting changed'}.")
         except Exception as e:
             logging.error(f"Failed to reload config: {e}")
 
-def setup_logging(log_file):
+def setup_logging(config):
     """
-    Configures logging with a rotating file handler.
+    Points the background log writer at the configuration's LOG_FILE and LOG_FORMAT.
     This function should be called whenever the config file is reloaded.
+    The root logger keeps its queue handler, so nothing is torn down.
     """
-    max_log_size = 5 * 1024 * 1024  # 5 MB
-    backup_count = 3  # Keep 3 backup logs
+    log_writer.switch_to(make_log_handler(config))
+    logging.info(f"Logging reconfigured. Now writing to: {config['LOG_FILE']} ({config['LOG_FORMAT']})")
 
-    # Remove old handlers (to avoid duplicate log entries)
-    for handler in logging.root.handlers[:]:
-        logging.root.removeHandler(handler)
 
-    # Set up logging again
-    logging.basicConfig(
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        encoding="utf-8",
-        level=logging.INFO,
-        handlers=[
-            RotatingFileHandler(log_file, maxBytes=max_log_size, backupCount=backup_count)
-        ],
-    )
 
-    logging.info("Logging reconfigured. Now writing to: " + log_file)
+logging.info("====================================")
+logging.info("Athan automation script initialized.")
+
+# ================================
+# Chromecast Device Registry
+# ================================
+DeviceRecord = namedtuple('DeviceRecord', 'name host port uuid model_name last_seen cast_info')
 
 
+def configured_device_names(config):
+    """Returns the friendly names of every device configured for any site."""
+    return {
+        name for site in site_configs(config).values()
+        for key in ('ATHAN_DEVICE', 'IFTAR_DEVICE') for name in site[key]
+    }
 
-logging.info("====================================")
-logging.info("Athan automation script initialized.")
 
-def get_random_athan_file(prayer_name, month=None):
+class DeviceRegistry:
+    """
+    Long-lived Chromecast discovery for the whole process.
+    A single Zeroconf instance and CastBrowser keep a live map of
+    friendly name -> DeviceRecord, so the cast path can look a device up
+    directly instead of running a fresh mDNS discovery at prayer time.
+    The last address of each configured device is persisted to
+    DEVICE_CACHE_FILE, so after a restart the cast path can connect before
+    discovery has seen the device; discovery results then confirm or
+    correct the cached addresses in the background.
+    Implements pychromecast's AbstractCastListener callbacks.
+    """
+
+    def __init__(self):
+        self._devices = {}  # friendly name -> DeviceRecord
+        self._names = {}  # uuid -> friendly name
+        self._changed = threading.Condition()
+        self._cached = {}  # friendly name -> cache entry (host, port, uuid, ...)
+        self._confirmed = set()  # cached names seen by discovery since loading
+        self._cache_file = None
+        self._save_lock = threading.Lock()
+        self.zconf = None
+        self.browser = None
+
+    def load_cache(self, path):
+        """Loads the persisted device addresses from path ('' disables the cache)."""
+        if path == self._cache_file:
+            return
+        self._cache_file, cached = path or None, {}
+        if path:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    cached = json.load(f)
+                logging.info(f"Loaded cached addresses for {len(cached)} Chromecast(s) from {path}")
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable device cache {path}: {e}")
+        with self._changed:
+            self._cached, self._confirmed = cached, set()
+
+    def cached(self, device_name):
+        """Returns a DeviceRecord for the cached address of a friendly name, or None."""
+        from uuid import UUID
+        from pychromecast.models import CastInfo, HostServiceInfo
+
+        entry = self._cached.get(device_name)
+        if entry is None:
+            return None
+        try:
+            uuid = UUID(entry['uuid'])
+            cast_info = CastInfo(
+                {HostServiceInfo(entry['host'], entry['port'])}, uuid, entry.get('model_name'), device_name,
+                entry['host'], entry['port'], entry.get('cast_type'), entry.get('manufacturer')
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            logging.warning(f"Ignoring malformed device cache entry for {device_name}: {e}")
+            return None
+        return DeviceRecord(device_name, entry['host'], entry['port'], uuid, entry.get('model_name'),
+                            entry.get('last_seen'), cast_info)
+
+    def _remember(self, record):
+        """Records a discovered address in the device cache; called from the discovery threads."""
+        if not self._cache_file or record.name not in configured_device_names(current_config):
+            return
+        info = record.cast_info
+        entry = {
+            'host': record.host, 'port': record.port, 'uuid': str(record.uuid), 'model_name': record.model_name,
+            'cast_type': info.cast_type, 'manufacturer': info.manufacturer,
+        }
+        with self._changed:
+            previous = self._cached.get(record.name)
+            known = previous is not None and {key: previous.get(key) for key in entry} == entry
+            first_sighting = record.name not in self._confirmed
+            self._confirmed.add(record.name)
+            if known and not first_sighting:
+                return
+            self._cached[record.name] = dict(entry, last_seen=int(record.last_seen))
+            snapshot = dict(self._cached)
+        if known:
+            logging.info(f"Cached address of {record.name} confirmed by discovery.")
+        elif previous is not None:
+            logging.info(f"Cached address of {record.name} was stale ({previous.get('host')}:{previous.get('port')}); "
+                         f"now {record.host}:{record.port}.")
+        self._save_cache(snapshot)
+
+    def _save_cache(self, entries):
+        """Writes the device cache atomically (temporary file, then rename)."""
+        with self._save_lock:
+            temporary = f"{self._cache_file}.tmp"
+            try:
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    json.dump(entries, f, indent=2, sort_keys=True)
+                os.replace(temporary, self._cache_file)
+            except OSError as e:
+                logging.warning(f"Could not write the device cache {self._cache_file}: {e}")
+
+    def start(self):
+        import pychromecast.discovery
+        import zeroconf
+
+        self.zconf = zeroconf.Zeroconf()
+        self.browser = pychromecast.discovery.CastBrowser(self, self.zconf)
+        self.browser.start_discovery()
+        logging.info("Chromecast discovery browser started.")
+
+    def stop(self):
+        if self.browser:
+            self.browser.stop_discovery()  # Also closes the Zeroconf instance
+            self.browser, self.zconf = None, None
+
+    def lookup(self, device_name):
+        """Returns the DeviceRecord for a friendly name, or None if not seen."""
+        return self._devices.get(device_name)
+
+    def wait_for(self, device_name, timeout):
+        """Returns the DeviceRecord for a friendly name, waiting up to timeout seconds for it to appear."""
+        with self._changed:
+            self._changed.wait_for(lambda: device_name in self._devices, timeout=timeout)
+            return self._devices.get(device_name)
+
+    def names(self):
+        return sorted(self._devices)
+
+    # AbstractCastListener callbacks (called from the discovery threads)
+    def add_cast(self, uuid, service):
+        self._update(uuid, appeared=True)
+
+    def update_cast(self, uuid, service):
+        self._update(uuid, appeared=False)
+
+    def remove_cast(self, uuid, service, cast_info):
+        with self._changed:
+            name = self._names.pop(uuid, None)
+            record = self._devices.get(name)
+            if record is not None and record.uuid == uuid:
+                del self._devices[name]
+        logging.info(f"Chromecast disappeared: {cast_info.friendly_name} ({cast_info.host}:{cast_info.port})")
+
+    def _update(self, uuid, appeared):
+        cast_info = self.browser.devices.get(uuid)
+        if cast_info is None or not cast_info.friendly_name:
+            return
+        record = DeviceRecord(
+            cast_info.friendly_name, cast_info.host, cast_info.port, uuid,
+            cast_info.model_name, time.time(), cast_info
+        )
+        with self._changed:
+            old_name = self._names.get(uuid)
+            if old_name is not None and old_name != record.name:
+                self._devices.pop(old_name, None)
+            previous = self._devices.get(record.name)
+            self._names[uuid] = record.name
+            self._devices[record.name] = record
+            self._changed.notify_all()
+
+        if appeared or previous is None:
+            logging.info(f"Chromecast appeared: {record.name} ({record.host}:{record.port}, {uuid})")
+        elif (previous.host, previous.port) != (record.host, record.port):
+            logging.info(f"Chromecast {record.name} moved to {record.host}:{record.port}")
+        self._remember(record)
+
+
+device_registry = DeviceRegistry()
+
+
+# ================================
+# Audio Library Index
+# ================================
+AUDIO_CONTENT_TYPES = {
+    '.mp3': 'audio/mp3',
+    '.m4a': 'audio/mp4',
+    '.aac': 'audio/aac',
+    '.ogg': 'audio/ogg',
+    '.oga': 'audio/ogg',
+    '.opus': 'audio/ogg',
+    '.flac': 'audio/flac',
+    '.wav': 'audio/wav',
+}
+
+TrackEntry = namedtuple('TrackEntry', 'folder path url title artist album duration size content_type mtime_ns')
+
+
+class AudioLibrary:
+    """
+    Index of the fajr, prayer and iftar audio folders.
+    Each audio file is read once for its tags and duration; a refresh only
+    stats the files and re-reads those whose mtime or size changed, so a file
+    overwritten or retagged in place (which leaves the folder's mtime alone)
+    is picked up too. Track selection then needs no disk I/O.
+    """
+    FOLDERS = {'fajr': 'FAJR_FOLDER', 'prayer': 'PRAYER_FOLDER', 'iftar': 'IFTAR_FOLDER'}
+
+    def __init__(self):
+        self._tracks = {name: [] for name in self.FOLDERS}
+
+    def refresh(self, config):
+        """
+        Rescans every folder (called when the file watcher reports audio changes).
+        Returns True if the index changed.
+        """
+        changed = False
+        base_url = media_base_url(config)
+        for folder_name, key in self.FOLDERS.items():
+            folder = config[key]
+            try:
+                tracks = self._scan(folder_name, folder, base_url)
+            except OSError as e:
+                if self._tracks[folder_name]:
+                    logging.error(f"Audio folder unavailable: {e}")
+                    changed = True
+                self._tracks[folder_name] = []
+                continue
+            if tracks == self._tracks[folder_name]:
+                continue
+            self._tracks[folder_name] = tracks
+            logging.info(f"Audio library: {len(tracks)} tracks indexed in {folder}")
+            changed = True
+        return changed
+
+    def _scan(self, folder_name, folder, base_url):
+        previous = {entry.path: entry for entry in self._tracks[folder_name]}
+        tracks = []
+        for file_name in sorted(os.listdir(folder)):
+            extension = os.path.splitext(file_name)[1].lower()
+            path = os.path.join(folder, file_name)
+            if extension not in AUDIO_CONTENT_TYPES or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            url = f"{base_url}/{folder_name}/{quote(file_name)}"
+            entry = previous.get(path)
+            if entry is None or entry.mtime_ns != st.st_mtime_ns or entry.size != st.st_size:
+                entry = self._read_track(folder_name, path, st, AUDIO_CONTENT_TYPES[extension])
+                if entry is None:
+                    continue
+            tracks.append(entry._replace(url=url))
+        return tracks
+
+    @staticmethod
+    def _read_track(folder_name, path, st, content_type):
+        """Reads tags and duration for one file. Returns None if it isn't readable audio."""
+        import mutagen
+
+        try:
+            audio = mutagen.File(path, easy=True)
+        except Exception as e:
+            logging.warning(f"Skipping unreadable audio file {path}: {e}")
+            return None
+        if audio is None:
+            logging.warning(f"Skipping non-audio file {path}")
+            return None
+        tags = audio.tags or {}
+
+        def tag(name):
+            values = tags.get(name) or [None]
+            return values[0]
+
+        return TrackEntry(
+            folder_name, path, None, tag('title'), tag('artist'), tag('album'),
+            audio.info.length if audio.info else None, st.st_size, content_type, st.st_mtime_ns
+        )
+
+    def tracks(self, folder_name):
+        return list(self._tracks[folder_name])
+
+    def choose(self, folder_name):
+        """Returns a random TrackEntry from the folder, or None if it is empty."""
+        tracks = self._tracks[folder_name]
+        return random.choice(tracks) if tracks else None
+
+
+audio_libraries = {}  # site name -> AudioLibrary
+
+
+def get_library(config):
+    """Returns the audio library of the configuration's site."""
+    return audio_libraries.setdefault(config['SITE'], AudioLibrary())
+
+
+def get_random_athan_file(prayer_name, month=None, config=None):
     """
-    Select a random Athan file based on the prayer and month.
+    Select a random Athan track from the audio library based on the prayer and month.
+    config selects the site (default: the single-site configuration).
+    Returns a TrackEntry, or None if the folder has no audio.
     """
+    config = config or current_config
     prayer_name = prayer_name.lower()
-    folder, folder_name = None, None
-    
+
     if prayer_name == 'fajr':
-        folder, folder_name = current_config['FAJR_FOLDER'], 'fajr'
+        folder_name = 'fajr'
     elif prayer_name == 'maghrib' and month == 'Ramadan':
-        folder, folder_name = current_config['IFTAR_FOLDER'], 'iftar'
+        folder_name = 'iftar'
     else:
-        folder, folder_name = current_config['PRAYER_FOLDER'], 'prayer'
+        folder_name = 'prayer'
 
-    try:
-        files = os.listdir(folder)
-        if not files:
-            raise FileNotFoundError(f"No files found in {folder}")
-        audio_file = random.choice(files)
-        logging.info(f"Selected file: {audio_file} for {prayer_name} during {month}")
-        return f"{current_config['LIGHTTPD_BASE_URL']}/{folder_name}/{audio_file}"
-    except Exception as e:
-        logging.error(f"Error selecting Athan file: {e}")
+    track = get_library(config).choose(folder_name)
+    if track is None:
+        logging.error(f"{site_label(config)}Error selecting Athan file: no audio files indexed in the {folder_name} folder")
         return None
+    # Planning picks tracks for events that may be re-planned; run_event() logs the one cast
+    logging.debug(f"{site_label(config)}Selected file: {os.path.basename(track.path)} for {prayer_name} during {month}")
+    return transcoder.rendition(track)
 
-def get_id3_metadata(file_path):
+
+# ================================
+# Transcoded Audio Cache
+# ================================
+class Transcoder(threading.Thread):
     """
-    Extract ID3 metadata (title, artist, album) from the given MP3 file.
-    Returns a dictionary with keys 'title', 'artist', 'album'.
+    Background worker that renders every indexed track once with ffmpeg into
+    TRANSCODE_FOLDER: constant bitrate MP3, loudness normalized, with leading
+    silence trimmed, so receivers buffer small files of consistent volume.
+    Renditions are named by a hash of the source content and the render
+    settings; a changed source simply gets a new entry and stale ones are
+    removed. Tracks are served from the source file until their rendition exists.
     """
-    try:
-        audio = EasyID3(file_path)
-        title = audio.get('title', ['Unknown Title'])[0]
-        artist = audio.get('artist', ['Unknown Artist'])[0]
-        album = audio.get('album', ['Unknown Album'])[0]
-        return {'title': title, 'artist': artist, 'album': album}
-    except Exception as e:
-        logging.error(f"Error reading ID3 metadata from {file_path}: {e}")
-        return {}
+    version = 1  # bump when the ffmpeg pipeline changes
+
+    def __init__(self):
+        super().__init__(name='transcoder', daemon=True)
+        self._wakeup = threading.Condition()
+        self._pending = None  # (config, tracks) for the next pass
+        self._keys = {}  # (path, mtime_ns, size, settings) -> rendition key
+        self._renditions = {}  # rendition key -> (path, size, duration)
+        self._settings = None
+        self._base_url = None
+        self._warned = False
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers a callable invoked (from the transcoder thread) when new renditions are ready."""
+        self._listeners.append(callback)
+
+    @staticmethod
+    def settings(config):
+        if not config['TRANSCODE_AUDIO']:
+            return None
+        return (config['TRANSCODE_FOLDER'], config['TRANSCODE_BITRATE'], config['LOUDNESS_TARGET'], config['FFMPEG_PATH'])
+
+    def sync(self, config, tracks):
+        """Queues a pass over the library's tracks (call after every refresh)."""
+        with self._wakeup:
+            self._settings = self.settings(config)
+            self._base_url = media_base_url(config)
+            self._pending = (self._settings, list(tracks)) if self._settings else None
+            self._wakeup.notify()
+
+    def rendition(self, track):
+        """Returns the cached rendition of a track, or the track itself."""
+        settings = self._settings
+        if settings is None:
+            return track
+        key = self._keys.get((track.path, track.mtime_ns, track.size, settings))
+        cached = self._renditions.get(key)
+        if cached is None:
+            return track
+        path, size, duration = cached
+        return track._replace(
+            path=path, url=f"{self._base_url}/cache/{os.path.basename(path)}",
+            size=size, duration=duration or track.duration, content_type='audio/mp3'
+        )
+
+    def run(self):
+        while True:
+            with self._wakeup:
+                while self._pending is None:
+                    self._wakeup.wait()
+                settings, tracks = self._pending
+                self._pending = None
+            try:
+                self._pass(settings, tracks)
+            except Exception as e:
+                logging.error(f"Audio transcoding failed: {e}")
+
+    def _pass(self, settings, tracks):
+        folder, ffmpeg = settings[0], settings[3]
+        if not shutil.which(ffmpeg):
+            if not self._warned:
+                logging.error(f"Audio transcoding is enabled but {ffmpeg} was not found; serving the original files.")
+                self._warned = True
+            return
+        os.makedirs(folder, exist_ok=True)
+        wanted, memos = set(), set()
+        rendered = False
+        for track in tracks:
+            if self._pending is not None:
+                return  # Superseded by a newer pass
+            memo = (track.path, track.mtime_ns, track.size, settings)
+            memos.add(memo)
+            key = self._keys.get(memo)
+            if key is None:
+                try:
+                    key = self._keys[memo] = self._hash(track.path, settings)
+                except OSError as e:
+                    logging.warning(f"Could not read {track.path} for transcoding: {e}")
+                    continue
+            wanted.add(key)
+            if key not in self._renditions:
+                self._render(track.path, key, settings)
+                rendered = rendered or key in self._renditions
+        # Forget the hashes of replaced source versions and earlier settings
+        self._keys = {memo: key for memo, key in self._keys.items() if memo in memos}
+
+        for file_name in os.listdir(folder):
+            key, extension = os.path.splitext(file_name)
+            if extension == '.mp3' and len(key) == 24 and key not in wanted:
+                os.remove(os.path.join(folder, file_name))
+                self._renditions.pop(key, None)
+                logging.info(f"Removed stale transcoded file {file_name}")
+        if rendered:
+            for callback in self._listeners:
+                callback()
+
+    def _hash(self, path, settings):
+        digest = hashlib.sha256(repr((self.version,) + settings[1:3]).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()[:24]
+
+    def _render(self, source, key, settings):
+        folder, bitrate, loudness, ffmpeg = settings
+        target = os.path.join(folder, f"{key}.mp3")
+        if not os.path.exists(target):
+            temporary = os.path.join(folder, f".{key}.tmp.mp3")
+            filters = f"silenceremove=start_periods=1:start_threshold=-50dB,loudnorm=I={loudness}:TP=-1.5:LRA=11"
+            command = [
+                ffmpeg, '-nostdin', '-hide_banner', '-loglevel', 'error', '-y', '-i', source,
+                '-vn', '-af', filters, '-ar', '44100', '-codec:a', 'libmp3lame', '-b:a', bitrate,
+                '-map_metadata', '0', '-id3v2_version', '3', temporary,
+            ]
+            started = time.monotonic()
+            try:
+                subprocess.run(command, check=True, capture_output=True, timeout=600)
+            except (OSError, subprocess.SubprocessError) as e:
+                detail = e.stderr.decode(errors='replace').strip() if getattr(e, 'stderr', None) else e
+                logging.error(f"Transcoding {source} failed: {detail}")
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                return
+            os.replace(temporary, target)
+            logging.info(f"Transcoded {os.path.basename(source)} in {time.monotonic() - started:.1f}s")
+        import mutagen
+
+        try:
+            audio = mutagen.File(target)
+            duration = audio.info.length if audio and audio.info else None
+        except Exception:
+            duration = None
+        self._renditions[key] = (target, os.path.getsize(target), duration)
+
+
+transcoder = Transcoder()
 
 
-def cast_announcement_and_athan(audio_url, device_name, prayer_name):
+# ================================
+# Embedded Media Server
+# ================================
+def media_base_url(config):
     """
-    Casts the Athan to the specified device and waits until playback finishes.
+    Returns the base URL media is served from: the embedded server when
+    MEDIA_SERVER_PORT is set (with the site name as a path prefix in
+    multi-site mode), otherwise the external web server.
     """
-    try:
-        
-        # Extract metadata from the MP3 file
-        local_audio_path = audio_url.replace(current_config['LIGHTTPD_BASE_URL'], "/var/www/html/athan")  # Convert URL to local path
-        metadata = get_id3_metadata(local_audio_path)
-        
-        if "iftar" in audio_url:
-            thumbnail_url = current_config['IFTAR_ART_URL']
-        else:
-            thumbnail_url = current_config['ATHAN_ART_URL'] 
-            
+    if not config['MEDIA_SERVER_PORT']:
+        return config['LIGHTTPD_BASE_URL']
+    base_url = config['MEDIA_SERVER_URL'] or f"http://{local_ip_address()}:{config['MEDIA_SERVER_PORT']}"
+    return f"{base_url}/{quote(config['SITE'], safe='')}" if config['SITE'] else base_url
 
-        chromecasts = None
-        browser = None
 
-        # Retry loop for Chromecast discovery
-        for attempt in range(max_retries):
+def artwork_url(config, key):
+    """
+    Returns the artwork URL for ATHAN_ART_URL/IFTAR_ART_URL, served by the
+    embedded server when it is enabled and the image is in ARTWORK_FOLDER.
+    """
+    file_name = os.path.basename(urlsplit(config[key]).path)
+    if config['MEDIA_SERVER_PORT'] and os.path.isfile(os.path.join(config['ARTWORK_FOLDER'], file_name)):
+        return f"{media_base_url(config)}/art/{quote(file_name)}"
+    return config[key]
+
+
+def local_ip_address():
+    """
+    Returns the LAN address Chromecasts can reach this host on, or 127.0.0.1
+    while there is no network yet. Probed on every call (no packet is sent),
+    so an address that arrives late or changes is picked up.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect(('10.255.255.255', 1))
+            return s.getsockname()[0]
+        except OSError:
+            return '127.0.0.1'
+
+
+class MediaCache:
+    """
+    Small in-memory LRU cache of file contents for the tracks likely to be
+    played next. Entries are validated against the file's mtime and size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> (mtime_ns, size, data)
+        self._lock = threading.Lock()
+
+    def get(self, path, st):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry[:2] == (st.st_mtime_ns, st.st_size):
+                self._entries.move_to_end(path)
+                return entry[2]
+        return None
+
+    def warm(self, paths):
+        """Loads the given files (blocking I/O; call off the event loop)."""
+        for path in paths:
             try:
-                # Initialize Zeroconf
-                zconf = zeroconf.Zeroconf()
-                chromecasts, browser = pychromecast.get_listed_chromecasts(friendly_names=[device_name], zeroconf_instance=zconf)
-                if chromecasts:
-                    break
-                logging.warning(f"Chromecast discovery attempt {attempt+1} failed - device not found")
-            except Exception as e:
-                logging.error(f"Discovery attempt {attempt+1} failed with error: {e}")
+                st = os.stat(path)
+                if st.st_size > self.max_bytes or self.get(path, st) is not None:
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                logging.warning(f"Could not cache {path}: {e}")
+                continue
+            with self._lock:
+                self._entries[path] = (st.st_mtime_ns, st.st_size, data)
+                self._entries.move_to_end(path)
+                while sum(len(e[2]) for e in self._entries.values()) > self.max_bytes:
+                    self._entries.popitem(last=False)
 
-            if attempt < max_retries - 1:
-                logging.info(f"Retrying discovery in {retry_delay} seconds...")
-                time.sleep(retry_delay)
+
+class MediaServer:
+    """
+    Optional HTTP server for the audio folders and artwork, run on the
+    scheduler's event loop. Supports GET/HEAD, single byte ranges,
+    ETag/Last-Modified validation and keep-alive; bodies come from the
+    in-memory cache when warm, otherwise via zero-copy sendfile.
+    """
+    keep_alive_timeout = 30
+
+    def __init__(self):
+        self.cache = MediaCache(0)
+        self._server = None
+
+    async def start(self, port):
+        self.cache.max_bytes = current_config['MEDIA_CACHE_MB'] * 1024 * 1024
+        self._server = await asyncio.start_server(self._handle, host=None, port=port)
+        logging.info(f"Media server listening on port {port}; media URL base is {media_base_url(current_config)}")
+
+    def resolve(self, url_path):
+        """Maps a request path ([/site]/folder/file) to a served file, or None."""
+        parts = [unquote(part) for part in url_path.lstrip('/').split('/')]
+        config = current_config
+        if len(parts) == 3:
+            config = current_config['SITES'].get(parts.pop(0))
+            if config is None:
+                return None
+        if len(parts) != 2 or parts[1] in ('', '.', '..') or '/' in parts[1]:
+            return None
+        folder_name, file_name = parts
+        if folder_name == 'art':
+            folder = config['ARTWORK_FOLDER']
+        elif folder_name == 'cache':
+            folder = current_config['TRANSCODE_FOLDER']
+            if not file_name.endswith('.mp3'):
+                return None
+        elif folder_name in AudioLibrary.FOLDERS:
+            folder = config[AudioLibrary.FOLDERS[folder_name]]
+            if os.path.splitext(file_name)[1].lower() not in AUDIO_CONTENT_TYPES:
+                return None
         else:
-            raise ConnectionError(f"No Chromecast with name {device_name} discovered after {max_retries} attempts.") 
-        cast = chromecasts[0]
-        cast.wait()
-        logging.info(f"Connected to {device_name}.")
-        
-        browser.stop_discovery()
-        zconf.close()
-        mc = cast.media_controller
-        logging.info(f"Active app is {cast.status.app_id}: {cast.status.display_name}.")
+            return None
+        path = os.path.join(folder, file_name)
+        return path if os.path.isfile(path) else None
 
-        # Stop the current app if any is active
-        if cast.status.app_id in ['CC32E753', '705D30C6']:
-            logging.info(f"Active streaming app {cast.status.app_id} found, attempting to stop app.")
-            cast.quit_app()
-            
-            # Wait until the Chromecast is ready
-            timeout = 30
-            start_time = time.time()
-            while time.time() - start_time < timeout:
-                if cast.status.app_id is None:  # Chromecast is idle
-                    logging.info("Chromecast is now idle.")
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request_line = await asyncio.wait_for(reader.readline(), timeout=self.keep_alive_timeout)
+                except asyncio.TimeoutError:
                     break
-                time.sleep(1)
-            else:
-                logging.warning("Chromecast did not become idle within timeout. Proceeding anyway.")
-        else:
-            logging.info("Chromecast speaker is  idle.")
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._send_status(writer, 400, 'Bad Request', close=True)
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                await self._respond(writer, method, urlsplit(target).path, headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception as e:
+            logging.error(f"Media server error: {e}")
+        finally:
+            writer.close()
 
-        # Set volume
-        volume_level = current_config['FAJR_VOLUME_LEVEL'] if prayer_name.lower() == "fajr" else current_config['ATHAN_VOLUME_LEVEL']
-        cast.set_volume(volume_level)
-        logging.info(f"Volume set to {volume_level * 100}% for {prayer_name}.")
-        
-        # Media metadata
-        media_metadata = {
-            'metadataType': 3,  # Generic media type
-            'title': metadata.get('title', 'Athan'),
-            'artist': metadata.get('artist', 'Unknown Reciter'),
-            'album': metadata.get('album', 'Islamic Prayers'),
-            'images': [{'url': thumbnail_url}]
-        }
+    async def _send_status(self, writer, code, reason, extra=None, close=False):
+        lines = [f"HTTP/1.1 {code} {reason}", "Content-Length: 0"] + list(extra or [])
+        if close:
+            lines.append("Connection: close")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1'))
+        await writer.drain()
 
-        # Play the media
-        retries = 3  # Retry up to 3 times if playback fails
-        for attempt in range(retries):
-            try:
-                mc.play_media(audio_url, 'audio/mp3', metadata=media_metadata)
-                mc.block_until_active(timeout=20)
-                logging.info(f"Playing Athan from URL: {audio_url}")
-                mc.play()
-                break
-            except Exception as e:
-                logging.error(f"Attempt {attempt + 1} to play media failed: {e}")
-                if attempt < retries - 1:
-                    logging.info("Retrying playback...")
-                    time.sleep(5)
-                else:
-                    logging.error(f"Failed to play media after {attempt + 1} attempts.")
-                    return
-        
-        # Wait for playback to finish
-        logging.info("Waiting for playback to complete.")
-        state_count = 0
-        while True:
-            time.sleep(5)
-            mc.update_status()  # Refresh the media status
-            if mc.status.player_state not in ['PLAYING', 'BUFFERING']:  # Playback finished
-                logging.info(f"Chromecast speaker status is now {mc.status.player_state}")
-                state_count = state_count + 1
-                if state_count >= 2:
-                    logging.info("Playback completed.")
-                    break
-        cast.wait(timeout=10)
-        # Quit the app and disconnect
-        if cast.status.display_name == "Default Media Receiver":
-            cast.quit_app()
-        # logging.info("Stopped the streaming app.")
-        cast.wait(timeout=10)
-        cast.disconnect()
-        logging.info(f"Disconnected from {device_name}")
-    except Exception as e:
-        logging.error(f"Error during casting: {e}")
+    async def _respond(self, writer, method, url_path, headers, keep_alive):
+        if method not in ('GET', 'HEAD'):
+            return await self._send_status(writer, 405, 'Method Not Allowed', ["Allow: GET, HEAD"])
+        path = self.resolve(url_path)
+        if path is None:
+            return await self._send_status(writer, 404, 'Not Found')
+
+        st = os.stat(path)
+        size = st.st_size
+        etag = f'"{st.st_mtime_ns:x}-{size:x}"'
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        content_type = AUDIO_CONTENT_TYPES.get(os.path.splitext(path)[1].lower()) or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        common = [f"ETag: {etag}", f"Last-Modified: {last_modified}", "Accept-Ranges: bytes",
+                  "Access-Control-Allow-Origin: *"]
+
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')] or (
+                'if-none-match' not in headers and headers.get('if-modified-since') == last_modified):
+            return await self._send_status(writer, 304, 'Not Modified', common)
+
+        start, end, status = 0, size - 1, (200, 'OK')
+        range_header = headers.get('range')
+        if range_header and headers.get('if-range', etag) in (etag, last_modified):
+            byte_range = self._parse_range(range_header, size)
+            if byte_range is None:
+                return await self._send_status(writer, 416, 'Range Not Satisfiable', [f"Content-Range: bytes */{size}"])
+            start, end = byte_range
+            status = (206, 'Partial Content')
+            common.append(f"Content-Range: bytes {start}-{end}/{size}")
+        length = end - start + 1
+
+        head = [f"HTTP/1.1 {status[0]} {status[1]}", f"Content-Type: {content_type}",
+                f"Content-Length: {length}"] + common
+        if not keep_alive:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode('latin-1'))
+        if method == 'HEAD' or length <= 0:
+            return await writer.drain()
+
+        data = self.cache.get(path, st)
+        if data is not None:
+            writer.write(data[start:end + 1])
+            return await writer.drain()
+        await writer.drain()
+        with open(path, 'rb') as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f, offset=start, count=length)
+
+    @staticmethod
+    def _parse_range(value, size):
+        """Parses a single 'bytes=' range; returns (start, end) or None if unsatisfiable."""
+        unit, _, spec = value.partition('=')
+        if unit.strip() != 'bytes' or ',' in spec:
+            return None
+        first, _, last = spec.strip().partition('-')
+        try:
+            if first == '':
+                suffix = int(last)
+                if suffix <= 0:
+                    return None
+                return max(size - suffix, 0), size - 1
+            start = int(first)
+            end = int(last) if last else size - 1
+        except ValueError:
+            return None
+        if start >= size or end < start:
+            return None
+        return start, min(end, size - 1)
+
+
+media_server = MediaServer()
+
+
+# ================================
+# Metrics
+# ================================
+class Counter:
+    """Prometheus-style counter with labels."""
+    kind = 'counter'
+
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Counter):
+    """Prometheus-style cumulative histogram with labels."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets):
+        super().__init__(name, help_text)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        result = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                labels = dict(key)
+                for bound, bucket_count in zip(self.buckets, counts):
+                    result.append((f"{self.name}_bucket", {**labels, 'le': f"{bound:g}"}, bucket_count))
+                result.append((f"{self.name}_bucket", {**labels, 'le': '+Inf'}, count))
+                result.append((f"{self.name}_sum", labels, total))
+                result.append((f"{self.name}_count", labels, count))
+        return result
 
 
-def get_next_prayer_time(file_path):
+def escape_label_value(value):
+    """Escapes a Prometheus label value (backslash, double quote and newline)."""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
     """
-    Reads the next prayer time from the CSV file.
+    Timing and outcome metrics for casting, rendered in the Prometheus text
+    format, plus the JSON summaries of the most recent events.
     """
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+    offset_buckets = (-1, -0.25, -0.1, 0, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.phase_seconds = Histogram(
+            'athan_phase_seconds', 'Time spent in each casting phase per device.', self.latency_buckets)
+        self.start_offset = Histogram(
+            'athan_start_offset_seconds', 'Actual minus scheduled playback start per device.', self.offset_buckets)
+        self.skew = Histogram(
+            'athan_play_skew_seconds', 'Spread of play commands across the devices of one event.', self.latency_buckets)
+        self.retries = Counter('athan_retries_total', 'Retries per device and stage.')
+        self.events = Counter('athan_events_total', 'Scheduled events by result.')
+        self.recent_events = deque(maxlen=50)
+
+    def render(self):
+        lines = []
+        for metric in (self.phase_seconds, self.start_offset, self.skew, self.retries, self.events):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                label_text = ','.join(f'{k}="{escape_label_value(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{label_text}}} {value:g}" if label_text else f"{name} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def record_event(self, summary):
+        """Keeps an event summary and appends it as a JSON line to EVENT_LOG_FILE."""
+        self.events.inc(result=summary['result'])
+        self.recent_events.append(summary)
+        log_file = current_config['EVENT_LOG_FILE']
+        if not log_file:
+            return
+        try:
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(summary) + '\n')
+        except OSError as e:
+            logging.warning(f"Could not write event summary to {log_file}: {e}")
+
+    async def serve(self, host, port):
+        """Serves /metrics and /events over HTTP on the running event loop."""
+        await asyncio.start_server(self._handle, host=host, port=port)
+        logging.info(f"Metrics available at http://{host}:{port}/metrics")
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode('latin-1').split()
+            path = urlsplit(parts[1]).path if len(parts) > 1 else ''
+            if path == '/metrics':
+                status, content_type, body = '200 OK', 'text/plain; version=0.0.4', self.render()
+            elif path == '/events':
+                status, content_type, body = '200 OK', 'application/json', json.dumps(list(self.recent_events), indent=1)
+            else:
+                status, content_type, body = '404 Not Found', 'text/plain', 'Not found\n'
+            body = body.encode('utf-8')
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                         f"Connection: close\r\n\r\n".encode('latin-1') + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+
+metrics = Metrics()
+
+
+def new_device_trace(device_name):
+    """Per-device record of phase timings, retries and start offset for one event."""
+    return {'device': device_name, 'phases': {}, 'retries': {}, 'start_offset': None, 'result': None}
+
+
+@contextmanager
+def timed_phase(trace, phase):
+    """Times a casting phase into the trace and the phase histogram."""
+    started = time.monotonic()
     try:
-        df = pd.read_csv(file_path, parse_dates=["Time and Date"])
-        now = datetime.now()
-        future_prayer_times = df[df["Time and Date"] > now]
-
-        if not future_prayer_times.empty:
-            next_prayer = future_prayer_times.iloc[0]
-            logging.info(f"Next prayer: {next_prayer['Prayer Name']} at {next_prayer['Time and Date']} during {next_prayer['Month']}")
-            return next_prayer["Prayer Name"], next_prayer["Time and Date"], next_prayer["Month"]
-        else:
-            logging.warning("No upcoming prayer times found.")
-            return None, None, None
-    except Exception as e:
-        logging.error(f"Error reading the CSV file: {e}")
-        return None, None, None
+        yield
+    finally:
+        elapsed = time.monotonic() - started
+        metrics.phase_seconds.observe(elapsed, phase=phase, device=trace['device'])
+        trace['phases'][phase] = round(trace['phases'].get(phase, 0) + elapsed, 3)
+
+
+def count_retry(trace, stage):
+    metrics.retries.inc(stage=stage, device=trace['device'])
+    trace['retries'][stage] = trace['retries'].get(stage, 0) + 1
 
-def wait_until_next_prayer(prayer_time, prayer_name, month):
+
+class PlaybackWatcher:
     """
-    Waits until the specified prayer time, adjusting for Iftar announcements if needed.
+    Media status listener (pychromecast MediaStatusListener interface) that
+    signals when playback has finished.
+    The event is set once the watched media session has been
+    PLAYING/BUFFERING and then goes IDLE, or when the receiver reports that
+    loading failed. Statuses of other sessions (an abandoned preload, the
+    session a load replaced) are ignored; call watch() right before each
+    load whose completion is awaited.
     """
-    if month == 'Ramadan' and prayer_name.lower() == 'maghrib':
-        wait_time = (prayer_time - timedelta(minutes=2, seconds=30)) - datetime.now()
-        logging.info(f"Waiting {wait_time} for Iftar announcement.")
-    else:
-        wait_time = (prayer_time - timedelta(seconds=3)) - datetime.now()
-        logging.info(f"Waiting {wait_time} until {prayer_name}.")
 
-    if wait_time.total_seconds() > 0:
-        time.sleep(wait_time.total_seconds())
-    else:
-        logging.warning(f"Prayer time for {prayer_name} has already passed.")
+    def __init__(self):
+        self.finished = threading.Event()
+        self._ignored = set()
+        self.watch()
 
-while True:
-    try:
+    def watch(self, previous_session=None):
+        """Starts over for a new load, ignoring previous_session from now on."""
+        if previous_session is not None:
+            self._ignored.add(previous_session)
+        self.session_id = None
+        self.started = False
+        self.duration = None
+        self.idle_reason = None
+        self.finished.clear()
 
-        check_and_reload_config()
-        prayer_name, next_prayer_time, month = get_next_prayer_time(current_config['PRAYER_TIMES_FILE'])
-        if next_prayer_time:
-            wait_until_next_prayer(next_prayer_time, prayer_name, month)
-            check_and_reload_config()
-            logging.info("Waking up...")
-            device_name = current_config['IFTAR_DEVICE'] if month == 'Ramadan' and prayer_name.lower() == 'maghrib' else current_config['ATHAN_DEVICE']
-            audio_url = get_random_athan_file(prayer_name, month)
-            
-            if not audio_url:
-                logging.error("No audio file available. Skipping this prayer.")
-                continue
-            
-            # wait_until_next_prayer(next_prayer_time, prayer_name, month)
-            # Initialize Zeroconf for device discovery
-            # zconf = zeroconf.Zeroconf()
-            cast_announcement_and_athan(audio_url, device_name, prayer_name)
-            
-            # Wait for the prayer time to pass before reading the CSV file again
-            pause_time = 180
-            logging.info(f"Waiting for {pause_time / 60} minutes..")
-            time.sleep(pause_time)
-            logging.info(f"Resuming...")
-        else:
-            logging.warning("No more prayer times available. Exiting...")
-            break
-    except pychromecast.error.ChromecastConnectionError as cce:
-        logging.error(f"Chromecast connection lost: {cce}. Retrying in 60 seconds...")
-        time.sleep(60)
-    except Exception as e:
-        logging.error(f"Unhandled error: {e}. Retrying in 60 seconds...")
-        time.sleep(60)
+    def new_media_status(self, status):
+        session = status.media_session_id
+        if session is not None and (session in self._ignored or self.session_id not in (None, session)):
+            return
+        if status.duration:
+            self.duration = status.duration
+        if status.player_state in ('PLAYING', 'BUFFERING'):
+            self.started = True
+            self.session_id = self.session_id or session
+        elif self.started and status.player_state == 'IDLE':
+            self.idle_reason = status.idle_reason
+            self.finished.set()
+
+    def load_media_failed(self, queue_item_id, error_code):
+        self.idle_reason = f"LOAD_FAILED ({error_code})"
+        self.finished.set()
+
+
+def sleep_until(target_time):
+    """
+    Sleeps until the given epoch seconds.
+    The last few milliseconds are slept in small steps so the wake-up lands on the target.
+    """
+    while True:
+        remaining = target_time - time.time()
+        if remaining <= 0:
+            return
+        time.sleep(remaining - 0.01 if remaining > 0.02 else 0.001)
+
+
+def prepare_cast_session(device_name, prayer_name, trace=None, config=None, volume=None):
+    """
+    Pre-warms a cast session ahead of the prayer: connects to the device,
+    stops a competing streaming app, sets the volume (default: the
+    configured level for the prayer) and launches the Default Media
+    Receiver. Returns the connected Chromecast.
+    """
+    import pychromecast
+
+    config = config or current_config
+    device_timeout = config['DEVICE_TIMEOUT']
+    trace = trace if trace is not None else new_device_trace(device_name)
+
+    def connect(cast_info, timeout, tries):
+        cast = pychromecast.get_chromecast_from_cast_info(
+            cast_info, device_registry.zconf, tries=tries, retry_wait=retry_delay, timeout=timeout
+        )
+        try:
+            cast.wait(timeout=timeout)
+        except Exception:
+            cast.disconnect(timeout=0)
+            raise
+        return cast
+
+    # Until discovery has seen the device (e.g. right after a restart), try its cached address
+    cast, record = None, device_registry.lookup(device_name)
+    cached = None if record else device_registry.cached(device_name)
+    if cached:
+        with timed_phase(trace, 'connect'):
+            try:
+                cast = connect(cached.cast_info, min(direct_connect_timeout, device_timeout), tries=1)
+                record = cached
+            except Exception as e:
+                count_retry(trace, 'direct_connect')
+                logging.warning(f"Direct connection to {device_name} at cached address {cached.host}:{cached.port} "
+                                f"failed ({e}); falling back to discovery.")
+
+    if cast is None:
+        # Look the device up in the long-lived discovery registry
+        with timed_phase(trace, 'discovery'):
+            for attempt in range(max_retries):
+                record = device_registry.wait_for(device_name, timeout=retry_delay)
+                if record:
+                    break
+                count_retry(trace, 'discovery')
+                logging.warning(f"Chromecast discovery attempt {attempt+1} failed - {device_name} not in registry")
+            else:
+                raise ConnectionError(f"No Chromecast with name {device_name} discovered after {max_retries} attempts.")
+        with timed_phase(trace, 'connect'):
+            cast = connect(record.cast_info, device_timeout, tries=max_retries)
+    try:
+        logging.info(f"Connected to {device_name} at {record.host}:{record.port}.")
+        logging.info(f"Active app on {device_name} is {cast.status.app_id}: {cast.status.display_name}.")
+
+        # Stop the current app if any is active
+        if cast.status.app_id in ['CC32E753', '705D30C6']:
+            logging.info(f"Active streaming app {cast.status.app_id} found on {device_name}, attempting to stop app.")
+            with timed_phase(trace, 'quit_app'):
+                cast.quit_app(timeout=device_timeout)
+
+                # Wait until the Chromecast is ready
+                timeout = 30
+                start_time = time.time()
+                while time.time() - start_time < timeout:
+                    if cast.status.app_id is None:  # Chromecast is idle
+                        logging.info(f"{device_name} is now idle.")
+                        break
+                    time.sleep(1)
+                else:
+                    logging.warning(f"{device_name} did not become idle within timeout. Proceeding anyway.")
+        else:
+            logging.info(f"{device_name} is idle.")
+
+        # Set volume
+        volume_level = volume if volume is not None else event_volume(prayer_name, config)
+        cast.set_volume(volume_level, timeout=device_timeout)
+        logging.info(f"Volume on {device_name} set to {volume_level * 100}% for {prayer_name}.")
+
+        # Launch the receiver app now so only the LOAD is left for the prayer instant
+        if cast.status.app_id != pychromecast.config.APP_MEDIA_RECEIVER:
+            with timed_phase(trace, 'launch'):
+                cast.start_app(pychromecast.config.APP_MEDIA_RECEIVER, timeout=device_timeout)
+            logging.info(f"Default Media Receiver launched on {device_name}.")
+        return cast
+    except Exception:
+        cast.disconnect(timeout=0)
+        raise
+
+
+def preload_media(mc, track, media_metadata):
+    """
+    Loads the track on the receiver paused (autoplay off) so it is fetched and
+    buffered ahead of time. Returns True if a paused media session is ready.
+    A receiver that ignores autoplay and starts playing is stopped again, so
+    the athan does not sound early; the caller then loads it at play time.
+    """
+    try:
+        mc.play_media(track.url, track.content_type, metadata=media_metadata, autoplay=False, stream_type='BUFFERED')
+        mc.block_until_active(timeout=20)
+        if not mc.status.media_session_id:
+            raise TimeoutError("no media session became active")
+        # Give the receiver a moment to report the buffered, paused state
+        deadline = time.time() + 10
+        while mc.status.player_state not in ('PAUSED', 'PLAYING') and time.time() < deadline:
+            time.sleep(0.2)
+        if mc.status.player_state != 'PAUSED':
+            raise RuntimeError(f"receiver is {mc.status.player_state} instead of PAUSED")
+        logging.info(f"Preloaded {track.url} (player state {mc.status.player_state}).")
+        return True
+    except Exception as e:
+        logging.warning(f"Preloading media failed, falling back to loading at play time: {e}")
+        if mc.status.media_session_id and mc.status.player_state != 'IDLE':
+            try:
+                mc.stop()
+            except Exception as e:
+                logging.warning(f"Could not stop the preloaded media: {e}")
+        return False
+
+
+def cast_to_device(track, device_name, prayer_name, media_metadata, scheduled, trace=None, config=None, volume=None):
+    """
+    Runs the full cast cycle on one device: prepare the session (with its own
+    retries), preload if enabled, hold until the scheduled epoch seconds,
+    play, and wait for playback to finish (bounded by the track's duration).
+    Phase timings, retries and the start offset are recorded in trace.
+    Returns the epoch seconds the play command was sent, or None on failure.
+    """
+    config = config or current_config
+    trace = trace if trace is not None else new_device_trace(device_name)
+    cast = None
+    for attempt in range(max_retries):
+        try:
+            cast = prepare_cast_session(device_name, prayer_name, trace, config, volume)
+            break
+        except Exception as e:
+            logging.error(f"Preparing {device_name} failed (attempt {attempt + 1}): {e}")
+            if attempt < max_retries - 1:
+                count_retry(trace, 'prepare')
+                time.sleep(retry_delay)
+    else:
+        trace['result'] = 'prepare_failed'
+        return None
+
+    try:
+        mc = cast.media_controller
+        watcher = PlaybackWatcher()
+        mc.register_status_listener(watcher)
+        if config['PRELOAD_MEDIA']:
+            with timed_phase(trace, 'preload'):
+                preloaded = preload_media(mc, track, media_metadata)
+        else:
+            preloaded = False
+
+        # Hold the warm session until the scheduled instant
+        if scheduled > time.time():
+            logging.info(f"Session ready on {device_name}, holding until {datetime.fromtimestamp(scheduled)}.")
+            sleep_until(scheduled)
+
+        # A preloaded track only needs the PLAY command
+        play_sent = None
+        if preloaded:
+            try:
+                play_sent = time.time()
+                mc.play()
+                logging.info(f"Playing preloaded Athan on {device_name} from URL: {track.url}")
+            except Exception as e:
+                logging.error(f"Playing preloaded media on {device_name} failed, reloading it: {e}")
+                play_sent, preloaded = None, False
+
+        # Play the media
+        retries = 0 if preloaded else 3  # Retry up to 3 times if playback fails
+        for attempt in range(retries):
+            try:
+                watcher.watch(mc.status.media_session_id)
+                play_sent = time.time()
+                with timed_phase(trace, 'load'):
+                    mc.play_media(track.url, track.content_type, metadata=media_metadata)
+                    mc.block_until_active(timeout=20)
+                logging.info(f"Playing Athan on {device_name} from URL: {track.url}")
+                mc.play()
+                break
+            except Exception as e:
+                logging.error(f"Attempt {attempt + 1} to play media on {device_name} failed: {e}")
+                if attempt < retries - 1:
+                    count_retry(trace, 'play')
+                    logging.info("Retrying playback...")
+                    time.sleep(5)
+                else:
+                    logging.error(f"Failed to play media on {device_name} after {attempt + 1} attempts.")
+                    trace['result'] = 'play_failed'
+                    return None
+        start_offset = time.time() - scheduled
+        trace['start_offset'] = round(start_offset, 3)
+        metrics.start_offset.observe(start_offset, device=device_name)
+        logging.info(f"Start offset for {prayer_name} on {device_name}: {start_offset:+.3f}s after scheduled time.")
+
+        # Wait for the status listener to report the end of playback, bounded
+        # by the track's known duration (or the receiver's, once reported)
+        logging.info(f"Waiting for playback on {device_name} to complete.")
+        grace = 15
+        trace['result'] = 'played'
+        with timed_phase(trace, 'playback'):
+            while not watcher.finished.is_set():
+                known_duration = track.duration or watcher.duration or config['MAX_PLAYBACK_SECONDS']
+                remaining = play_sent + known_duration + grace - time.time()
+                if remaining <= 0:
+                    logging.warning(f"Playback on {device_name} did not report completion within {known_duration + grace:.0f}s. Releasing device.")
+                    trace['result'] = 'completion_timeout'
+                    break
+                watcher.finished.wait(timeout=min(remaining, 1))
+            else:
+                logging.info(f"Playback on {device_name} completed ({watcher.idle_reason}).")
+        cast.wait(timeout=10)
+        # Quit the app and disconnect
+        if cast.status.display_name == "Default Media Receiver":
+            cast.quit_app()
+        return play_sent
+    except Exception as e:
+        logging.error(f"Error during casting to {device_name}: {e}")
+        trace['result'] = 'error'
+        return None
+    finally:
+        cast.disconnect(timeout=10)
+        logging.info(f"Disconnected from {device_name}")
+
+
+def event_devices(prayer_name, month, config):
+    """Returns the device names for an event: IFTAR_DEVICE for the Ramadan Iftar announcement, else ATHAN_DEVICE."""
+    if month == 'Ramadan' and prayer_name.lower() == 'maghrib':
+        return config['IFTAR_DEVICE']
+    return config['ATHAN_DEVICE']
+
+
+def event_volume(prayer_name, config):
+    """Returns the volume level for a prayer."""
+    return config['FAJR_VOLUME_LEVEL'] if prayer_name.lower() == "fajr" else config['ATHAN_VOLUME_LEVEL']
+
+
+def build_media_metadata(track, config):
+    """Returns the cast media metadata for a track, with the site's artwork."""
+    if track.folder == 'iftar':
+        thumbnail_url = artwork_url(config, 'IFTAR_ART_URL')
+    else:
+        thumbnail_url = artwork_url(config, 'ATHAN_ART_URL')
+
+    return {
+        'metadataType': 3,  # Generic media type
+        'title': track.title or 'Athan',
+        'artist': track.artist or 'Unknown Reciter',
+        'album': track.album or 'Islamic Prayers',
+        'images': [{'url': thumbnail_url}]
+    }
+
+
+def cast_announcement_and_athan(track, device_names, prayer_name, play_at=None, config=None,
+                                media_metadata=None, volume=None):
+    """
+    Casts the Athan track to every device in device_names concurrently and waits
+    until playback finishes on all of them. Each device is prepared straight
+    away and started at play_at (a datetime, default: as soon as it is ready),
+    so one slow or unreachable speaker does not hold up the others.
+    config is the site's settings (default: the single-site configuration);
+    media_metadata and volume are resolved from it unless the plan supplies them.
+    """
+    config = config or current_config
+    try:
+        media_metadata = media_metadata or build_media_metadata(track, config)
+
+        if not device_names:
+            logging.error(f"{site_label(config)}No Chromecast device configured for {prayer_name}.")
+            return
+
+        scheduled = play_at.timestamp() if play_at else time.time()
+        traces = {name: new_device_trace(name) for name in device_names}
+        with ThreadPoolExecutor(max_workers=len(device_names), thread_name_prefix='cast') as pool:
+            futures = {
+                name: pool.submit(
+                    cast_to_device, track, name, prayer_name, dict(media_metadata), scheduled, traces[name], config, volume
+                )
+                for name in device_names
+            }
+            play_times = {name: future.result() for name, future in futures.items()}
+
+        started = {name: t for name, t in play_times.items() if t is not None}
+        failed = [name for name, t in play_times.items() if t is None]
+        if failed:
+            logging.error(f"{site_label(config)}Athan could not be played on: {', '.join(failed)}")
+        skew_ms = None
+        if len(started) > 1:
+            skew_ms = (max(started.values()) - min(started.values())) * 1000
+            metrics.skew.observe(skew_ms / 1000)
+            if skew_ms > config['SKEW_BUDGET_MS']:
+                logging.warning(f"Play command skew across devices was {skew_ms:.0f} ms (budget {config['SKEW_BUDGET_MS']} ms).")
+            else:
+                logging.info(f"Play command skew across devices was {skew_ms:.0f} ms.")
+
+        metrics.record_event({
+            'site': config['SITE'],
+            'prayer': prayer_name,
+            'scheduled': datetime.fromtimestamp(scheduled).isoformat(timespec='seconds'),
+            'track': os.path.basename(track.path),
+            'result': 'failed' if not started else 'partial' if failed else 'played',
+            'skew_ms': round(skew_ms, 1) if skew_ms is not None else None,
+            'devices': list(traces.values()),
+        })
+    except Exception as e:
+        logging.error(f"Error during casting: {e}")
+
+
+# ================================
+# Prayer Schedule Index
+# ================================
+PRAYER_NAMES = ('Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha')
+HIJRI_MONTHS = (
+    "Muharram", "Safar", "Rabi' al-Awwal", "Rabi' al-Thani",
+    "Jumada al-Awwal", "Jumada al-Thani", "Rajab", "Sha'ban",
+    "Ramadan", "Shawwal", "Dhu al-Qi'dah", "Dhu al-Hijjah"
+)
+
+
+class ScheduleIndex:
+    """
+    In-memory index of the prayer times CSV.
+    The file is parsed once into a sorted array of epoch seconds plus small
+    prayer and Hijri month codes, so lookups are a binary search.
+    The file is only re-read when its mtime or size changes; rows appended
+    to the end of the file are parsed on their own. Times are local to the
+    given IANA timezone, or to the system timezone when it is empty.
+    """
+
+    def __init__(self, file_path, timezone=''):
+        self.file_path = file_path
+        self.timezone = timezone
+        self.tz = ZoneInfo(timezone) if timezone else None
+        self._epochs = array('q')
+        self._prayer_codes = bytearray()
+        self._month_codes = bytearray()
+        self._prayer_names = list(PRAYER_NAMES)
+        self._month_names = list(HIJRI_MONTHS)
+        self._columns = None
+        self._signature = None
+        self._offset = 0  # Bytes consumed so far (0 disables append detection)
+        self._tail = b''  # Last bytes consumed, used to confirm a pure append
+
+    def __len__(self):
+        return len(self._epochs)
+
+    def refresh(self):
+        """
+        Re-reads the file if its mtime or size changed.
+        Returns True when the index was (re)loaded.
+        """
+        st = os.stat(self.file_path)
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return False
+
+        with open(self.file_path, 'rb') as f:
+            appended = False
+            if self._offset and st.st_size > self._offset:
+                f.seek(self._offset - len(self._tail))
+                appended = f.read(len(self._tail)) == self._tail
+            if not appended:
+                f.seek(0)
+                self._reset()
+            data = f.read()
+
+        rows = self._parse(data, header_expected=not appended)
+        self._append_rows(rows)
+
+        if data.endswith(b'\n'):
+            self._offset += len(data)
+            self._tail = (self._tail + data)[-64:]
+        else:
+            # A trailing partial line may still be growing; reparse fully next time
+            self._offset, self._tail = 0, b''
+
+        self._signature = signature
+        if appended:
+            logging.info(f"Prayer schedule: {len(rows)} appended rows indexed ({len(self)} total).")
+        else:
+            logging.info(f"Prayer schedule loaded: {len(self)} entries from {self.file_path}")
+        return True
+
+    def _reset(self):
+        self._epochs = array('q')
+        self._prayer_codes = bytearray()
+        self._month_codes = bytearray()
+        self._columns = None
+        self._offset, self._tail = 0, b''
+
+    def _parse(self, data, header_expected):
+        """Parses CSV bytes into (epoch, prayer_code, month_code) tuples."""
+        rows = []
+        reader = csv.reader(data.decode('utf-8-sig').splitlines())
+        if header_expected:
+            header = next(reader, None)
+            if header is None:
+                return rows
+            self._columns = (
+                header.index('Prayer Name'), header.index('Time and Date'), header.index('Month')
+            )
+        name_col, time_col, month_col = self._columns
+
+        for row in reader:
+            if not row:
+                continue
+            try:
+                local = datetime.fromisoformat(row[time_col].strip())
+                if self.tz and local.tzinfo is None:
+                    local = local.replace(tzinfo=self.tz)
+                epoch = int(local.timestamp())
+            except (ValueError, IndexError) as e:
+                logging.warning(f"Skipping malformed schedule row {row}: {e}")
+                continue
+            rows.append((
+                epoch,
+                self._code(self._prayer_names, row[name_col].strip()),
+                self._code(self._month_names, row[month_col].strip()),
+            ))
+        return rows
+
+    @staticmethod
+    def _code(names, value):
+        """Returns the small integer code for value, interning unseen values."""
+        try:
+            return names.index(value)
+        except ValueError:
+            if len(names) >= 255:
+                raise ValueError(f"Too many distinct schedule labels (at '{value}')")
+            names.append(value)
+            return len(names) - 1
+
+    def _append_rows(self, rows):
+        if not rows:
+            return
+        in_order = all(rows[i][0] <= rows[i + 1][0] for i in range(len(rows) - 1))
+        if in_order and (not self._epochs or self._epochs[-1] <= rows[0][0]):
+            for epoch, prayer_code, month_code in rows:
+                self._epochs.append(epoch)
+                self._prayer_codes.append(prayer_code)
+                self._month_codes.append(month_code)
+            return
+
+        # Out-of-order rows: rebuild the arrays in sorted order
+        merged = sorted(list(zip(self._epochs, self._prayer_codes, self._month_codes)) + rows)
+        self._epochs = array('q', (r[0] for r in merged))
+        self._prayer_codes = bytearray(r[1] for r in merged)
+        self._month_codes = bytearray(r[2] for r in merged)
+
+    def _event(self, i):
+        return (
+            self._prayer_names[self._prayer_codes[i]],
+            datetime.fromtimestamp(self._epochs[i], self.tz),
+            self._month_names[self._month_codes[i]],
+        )
+
+    def next_event(self, after=None):
+        """
+        Returns (prayer_name, prayer_time, month) for the first entry strictly
+        after the given epoch seconds (default: now), or None.
+        """
+        after = time.time() if after is None else after
+        i = bisect_right(self._epochs, after)
+        return self._event(i) if i < len(self._epochs) else None
+
+    def upcoming(self, after=None, count=5):
+        """Returns up to count (prayer_name, prayer_time, month) entries after the given epoch."""
+        after = time.time() if after is None else after
+        start = bisect_right(self._epochs, after)
+        return [self._event(i) for i in range(start, min(start + count, len(self._epochs)))]
+
+
+# Binary schedule format written by tools/prayer_times_python.py --format binary
+# (see SCHEDULE_* there): header, JSON metadata padded to 8 bytes, then
+# records of UTC epoch (int64), prayer code and Hijri month code sorted by time.
+SCHEDULE_MAGIC = b'ATHANBIN'
+SCHEDULE_HEADER = struct.Struct('<8sHHIQ')
+SCHEDULE_RECORD = struct.Struct('<qBB')
+
+
+def is_binary_schedule(file_path):
+    """True if the file starts with the binary schedule magic."""
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(SCHEDULE_MAGIC)) == SCHEDULE_MAGIC
+    except OSError:
+        return False
+
+
+class BinarySchedule:
+    """
+    Memory-mapped binary schedule file.
+    Nothing is parsed: lookups binary-search the mapped records, so only the
+    few pages touched are resident however many years the file covers.
+    The file is remapped when its mtime or size changes; writers must replace
+    it by renaming (as the generator does), never rewrite it in place.
+    Offers the same next_event()/upcoming() interface as ScheduleIndex.
+    """
+
+    def __init__(self, file_path, timezone=''):
+        self.file_path = file_path
+        self.timezone = timezone
+        self.tz = ZoneInfo(timezone) if timezone else None
+        self.metadata = {}
+        self._prayer_names, self._month_names = list(PRAYER_NAMES), list(HIJRI_MONTHS)
+        self._map = None
+        self._count = 0
+        self._start = 0
+        self._record_size = SCHEDULE_RECORD.size
+        self._signature = None
+
+    def __len__(self):
+        return self._count
+
+    def refresh(self):
+        """
+        Remaps the file if its mtime or size changed.
+        Returns True when the schedule was (re)loaded.
+        """
+        st = os.stat(self.file_path)
+        signature = (st.st_mtime_ns, st.st_size)
+        if signature == self._signature:
+            return False
+
+        with open(self.file_path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, record_size, meta_size, count = SCHEDULE_HEADER.unpack_from(mapped)
+            if magic != SCHEDULE_MAGIC or version != 1 or record_size < SCHEDULE_RECORD.size:
+                raise ValueError(f"unsupported binary schedule (version {version}, record size {record_size})")
+            start = SCHEDULE_HEADER.size + meta_size
+            if len(mapped) < start + count * record_size:
+                raise ValueError(f"truncated binary schedule ({len(mapped)} bytes for {count} records)")
+            metadata = json.loads(mapped[SCHEDULE_HEADER.size:start].decode('utf-8'))
+        except (ValueError, struct.error) as e:
+            mapped.close()
+            raise ValueError(f"Cannot read {self.file_path}: {e}") from None
+
+        if self._map is not None:
+            self._map.close()
+        self._map, self.metadata = mapped, metadata
+        self._start, self._record_size, self._count = start, record_size, count
+        self._prayer_names, self._month_names = metadata['prayers'], metadata['months']
+        self._signature = signature
+        details = ', '.join(f"{key} {metadata[key]}" for key in ('site', 'method', 'timezone') if metadata.get(key))
+        logging.info(f"Prayer schedule mapped: {count} entries from {self.file_path}" + (f" ({details})" if details else ''))
+        return True
+
+    def _record(self, i):
+        return SCHEDULE_RECORD.unpack_from(self._map, self._start + i * self._record_size)
+
+    def _search(self, after):
+        """Index of the first record strictly after the given epoch seconds."""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid)[0] <= after:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _event(self, i):
+        epoch, prayer_code, month_code = self._record(i)
+        return (
+            self._prayer_names[prayer_code],
+            datetime.fromtimestamp(epoch, self.tz),
+            self._month_names[month_code],
+        )
+
+    def next_event(self, after=None):
+        """
+        Returns (prayer_name, prayer_time, month) for the first entry strictly
+        after the given epoch seconds (default: now), or None.
+        """
+        after = time.time() if after is None else after
+        i = self._search(after)
+        return self._event(i) if i < self._count else None
+
+    def upcoming(self, after=None, count=5):
+        """Returns up to count (prayer_name, prayer_time, month) entries after the given epoch."""
+        after = time.time() if after is None else after
+        start = self._search(after)
+        return [self._event(i) for i in range(start, min(start + count, self._count))]
+
+
+# ================================
+# In-process Prayer Time Calculation
+# ================================
+# Mirrors METHOD_PARAMS / METHOD_NAMES in tools/prayer_times_python.py
+METHOD_PARAMS = {
+    'jafari': {'fajr': 16, 'isha': 14, 'maghrib': '0 min', 'midnight': 'Jafari'},
+    'karachi': {'fajr': 18, 'isha': 18, 'maghrib': '0 min', 'midnight': 'Standard'},
+    'isna': {'fajr': 15, 'isha': 15, 'maghrib': '0 min', 'midnight': 'Standard'},
+    'mwl': {'fajr': 18, 'isha': 17, 'maghrib': '0 min', 'midnight': 'Standard'},
+    'makkah': {'fajr': 18.5, 'isha': '90 min', 'maghrib': '0 min', 'midnight': 'Standard'},
+    'egypt': {'fajr': 19.5, 'isha': 17.5, 'maghrib': '0 min', 'midnight': 'Standard'},
+    'tehran': {'fajr': 17.7, 'isha': 14, 'maghrib': 4.5, 'midnight': 'Jafari'},
+}
+
+
+def load_timezone(name):
+    """
+    Returns a ZoneInfo for an IANA name, or the system timezone when name is
+    empty: TZ if set (as time.localtime() would use it), else /etc/localtime.
+    """
+    if name:
+        return ZoneInfo(name)
+    tz = os.environ.get('TZ', '').lstrip(':')
+    try:
+        if tz and not os.path.isabs(tz):
+            return ZoneInfo(tz)
+        with open(tz or '/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f, key=tz or 'localtime')
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        # e.g. a POSIX TZ rule such as "EST5"; the C library still applies it
+        return datetime.now().astimezone().tzinfo
+
+
+class PrayerCalculator:
+    """
+    Computes prayer times on demand instead of reading a precomputed CSV.
+    Days are generated lazily as a rolling window of upcoming events; each
+    day's times and each Hijri month's date range are computed once and memoized.
+    Offers the same next_event()/upcoming() interface as ScheduleIndex.
+    """
+
+    def __init__(self, latitude, longitude, method='mwl', asr='standard', timezone=''):
+        if latitude is None or longitude is None:
+            raise ValueError("LATITUDE and LONGITUDE are required when SCHEDULE_SOURCE = calculate")
+        if method not in METHOD_PARAMS:
+            raise ValueError(f"Unknown CALCULATION_METHOD '{method}' (choose from: {', '.join(METHOD_PARAMS)})")
+        self.latitude, self.longitude = latitude, longitude
+        self.method, self.asr = method, asr
+        self.tz = load_timezone(timezone)
+        self.settings_key = (latitude, longitude, method, asr, timezone)
+
+        from praytimes import PrayTimes
+
+        self._praytimes = PrayTimes()
+        # PrayTimes keeps its settings in a class-level dict; give this instance its own copy
+        self._praytimes.settings = dict(PrayTimes.settings)
+        self._praytimes.adjust(METHOD_PARAMS[method])
+        self._praytimes.adjust({'asr': 'Hanafi' if asr == 'hanafi' else 'Standard'})
+        self._hijri_months = []  # (first day, last day, month name)
+        self._day_events = lru_cache(maxsize=64)(self._compute_day)
+
+    def __len__(self):
+        return 0
+
+    def refresh(self):
+        """Nothing to reload; present for interface parity with ScheduleIndex."""
+        return False
+
+    def hijri_month(self, day):
+        """Returns the Hijri month name of a date, converting once per month."""
+        for first, last, name in self._hijri_months:
+            if first <= day <= last:
+                return name
+        from hijridate import Hijri, Gregorian
+
+        hijri = Gregorian(day.year, day.month, day.day).to_hijri()
+        first = Hijri(hijri.year, hijri.month, 1).to_gregorian()
+        first = date(first.year, first.month, first.day)
+        last = first + timedelta(days=hijri.month_length() - 1)
+        name = HIJRI_MONTHS[hijri.month - 1]
+        self._hijri_months = (self._hijri_months + [(first, last, name)])[-3:]
+        return name
+
+    def _compute_day(self, day):
+        """Returns ((epoch, prayer_name, month), ...) for one local date."""
+        midnight = datetime(day.year, day.month, day.day, tzinfo=self.tz)
+        offset = midnight.utcoffset().total_seconds() / 3600
+        times = self._praytimes.getTimes(day, (self.latitude, self.longitude), offset, format='Float')
+        if str(METHOD_PARAMS[self.method]['isha']).endswith('min'):
+            # Isha is a fixed interval after Maghrib (the praytimes Python port subtracts it)
+            times['isha'] = times['maghrib'] + float(METHOD_PARAMS[self.method]['isha'].split()[0]) / 60.0
+        month = self.hijri_month(day)
+
+        events = []
+        for name in PRAYER_NAMES:
+            value = times[name.lower()]
+            if value != value:  # NaN: undefined at this latitude
+                logging.warning(f"{name} is undefined on {day}, skipped.")
+                continue
+            # Round to the minute the same way the CSV generator does
+            minutes = int(((value + 0.5 / 60) % 24) * 60)
+            local = midnight.replace(hour=minutes // 60, minute=minutes % 60)
+            events.append((int(local.timestamp()), name, month))
+        return tuple(events)
+
+    def events(self, after=None):
+        """Lazily yields (epoch, prayer_name, month) for every event after the given epoch."""
+        after = time.time() if after is None else after
+        day = datetime.fromtimestamp(after, self.tz).date() - timedelta(days=1)
+        while True:
+            for event in self._day_events(day):
+                if event[0] > after:
+                    yield event
+            day += timedelta(days=1)
+
+    def next_event(self, after=None):
+        """Returns (prayer_name, prayer_time, month) for the first event after the given epoch."""
+        return self.upcoming(after, 1)[0]
+
+    def upcoming(self, after=None, count=5):
+        """Returns the next count (prayer_name, prayer_time, month) events after the given epoch."""
+        return [
+            (name, datetime.fromtimestamp(epoch, self.tz), month)
+            for epoch, name, month in islice(self.events(after), count)
+        ]
+
+
+prayer_schedules = {}  # site name -> schedule engine
+
+
+def get_schedule(config):
+    """
+    Returns the schedule engine for the configuration's site: the indexed CSV
+    file or memory-mapped binary file, or the in-process calculator when
+    SCHEDULE_SOURCE = calculate.
+    The engine is kept across calls and rebuilt only when its settings change.
+    """
+    site = config['SITE']
+    prayer_schedule = prayer_schedules.get(site)
+    if config['SCHEDULE_SOURCE'] == 'calculate':
+        key = (config['LATITUDE'], config['LONGITUDE'], config['CALCULATION_METHOD'], config['ASR_METHOD'], config['TIMEZONE'])
+        if not isinstance(prayer_schedule, PrayerCalculator) or prayer_schedule.settings_key != key:
+            prayer_schedule = prayer_schedules[site] = PrayerCalculator(*key)
+            logging.info(f"{site_label(config)}Calculating prayer times in-process for {key[0]}, {key[1]} ({key[2]}, asr {key[3]}).")
+    else:
+        engine = BinarySchedule if is_binary_schedule(config['PRAYER_TIMES_FILE']) else ScheduleIndex
+        if (type(prayer_schedule) is not engine or prayer_schedule.file_path != config['PRAYER_TIMES_FILE']
+                or prayer_schedule.timezone != config['TIMEZONE']):
+            prayer_schedule = prayer_schedules[site] = engine(config['PRAYER_TIMES_FILE'], config['TIMEZONE'])
+    prayer_schedule.refresh()
+    return prayer_schedule
+
+
+# ================================
+# Input File Watcher
+# ================================
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+
+class FileWatcher(threading.Thread):
+    """
+    Watches the configuration file, the prayer times file and the audio
+    folders, and sets the `changed` event as soon as one of them changes so a
+    sleeping scheduler can wake up and re-plan.
+    Uses inotify through libc when available, otherwise polls mtimes.
+    Targets map a category ('config', 'schedule', 'audio') to paths; file
+    targets are watched through their parent directory so editors that
+    replace the file by renaming are still seen.
+    """
+
+    def __init__(self, poll_interval=5, debounce=0.5):
+        super().__init__(name='file-watcher', daemon=True)
+        self.changed = threading.Event()
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._targets = {}
+        self._targets_version = 0
+        self._pending = set()
+        self._listeners = []
+        self._libc = None
+
+    def add_listener(self, callback):
+        """Registers a callable invoked (from the watcher thread) after each change."""
+        self._listeners.append(callback)
+
+    def set_targets(self, targets):
+        """Replaces the watched paths, e.g. after a configuration reload."""
+        targets = {category: sorted(set(p for p in paths if p)) for category, paths in targets.items()}
+        with self._lock:
+            if targets != self._targets:
+                self._targets = targets
+                self._targets_version += 1
+
+    def take_changes(self):
+        """Returns and clears the set of categories that changed since the last call."""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self.changed.clear()
+        return pending
+
+    def _notify(self, categories):
+        if not categories:
+            return
+        time.sleep(self.debounce)  # Coalesce the burst of events an editor produces
+        with self._lock:
+            self._pending |= categories
+            self.changed.set()
+        logging.info(f"Detected change in: {', '.join(sorted(categories))}")
+        for callback in self._listeners:
+            callback()
+
+    def run(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        except (OSError, AttributeError) as e:
+            logging.info(f"inotify unavailable ({e}); polling inputs every {self.poll_interval}s.")
+            self._poll()
+            return
+        self._libc = libc
+        logging.info("Watching configuration, schedule and audio folders with inotify.")
+        self._inotify(fd)
+
+    def _watch_points(self):
+        """Returns {directory: [(category, basename or None for the whole folder)]}."""
+        points = {}
+        with self._lock:
+            targets = {category: list(paths) for category, paths in self._targets.items()}
+        for category, paths in targets.items():
+            for path in paths:
+                if os.path.isdir(path):
+                    points.setdefault(path, []).append((category, None))
+                else:
+                    points.setdefault(os.path.dirname(path) or '.', []).append((category, os.path.basename(path)))
+        return points
+
+    def _inotify(self, fd):
+        watches, version = {}, None
+        while True:
+            if version != self._targets_version:
+                version = self._targets_version
+                for wd in watches:
+                    self._libc.inotify_rm_watch(fd, wd)
+                watches = {}
+                for directory, interests in self._watch_points().items():
+                    wd = self._libc.inotify_add_watch(fd, os.fsencode(directory), WATCH_MASK)
+                    if wd < 0:
+                        logging.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+                        continue
+                    watches[wd] = interests
+
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if not readable:
+                continue
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                continue
+            categories, offset = set(), 0
+            while offset + 16 <= len(data):
+                wd, mask, cookie, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0').decode('utf-8', 'replace')
+                offset += 16 + length
+                for category, basename in watches.get(wd, ()):
+                    if basename is None or basename == name:
+                        categories.add(category)
+            self._notify(categories)
+
+    def _poll(self):
+        def signature(path):
+            try:
+                if os.path.isdir(path):
+                    # Files overwritten in place leave the folder's own mtime unchanged
+                    return sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                                  for entry in os.scandir(path))
+                st = os.stat(path)
+                return (st.st_mtime_ns, st.st_size)
+            except OSError:
+                return None
+
+        known = {}
+        while True:
+            with self._lock:
+                targets = {category: list(paths) for category, paths in self._targets.items()}
+            categories = set()
+            for category, paths in targets.items():
+                for path in paths:
+                    current = signature(path)
+                    if path in known and known[path] != current:
+                        categories.add(category)
+                    known[path] = current
+            self._notify(categories)
+            time.sleep(self.poll_interval)
+
+
+def watch_targets(config):
+    """Returns the FileWatcher targets for a configuration (all of its sites)."""
+    sites = site_configs(config).values()
+    return {
+        'config': [CONFIG_FILE],
+        'schedule': sorted({site['PRAYER_TIMES_FILE'] for site in sites if site['SCHEDULE_SOURCE'] == 'csv'}),
+        'audio': sorted({site[key] for site in sites for key in AudioLibrary.FOLDERS.values()}),
+    }
+
+
+file_watcher = FileWatcher()
+reload_lock = threading.Lock()  # The scheduler and the control socket reload from worker threads
+
+
+def reload_changed_inputs(categories, force=False):
+    """
+    Reloads only the inputs whose category changed: the configuration,
+    the prayer schedules and/or the audio libraries of every site.
+    With force, those inputs are re-read even if their files look unchanged.
+    A site whose schedule cannot be loaded is logged and skipped.
+    """
+    with reload_lock:
+        _reload_changed_inputs(categories, force)
+
+
+def _reload_changed_inputs(categories, force):
+    if 'config' in categories:
+        check_and_reload_config(force)
+        file_watcher.set_targets(watch_targets(current_config))
+        device_registry.load_cache(current_config['DEVICE_CACHE_FILE'])
+    if force and 'schedule' in categories:
+        prayer_schedules.clear()
+    if force and 'audio' in categories:
+        audio_libraries.clear()
+    sites = site_configs(current_config)
+    for registry in (prayer_schedules, audio_libraries):
+        for name in set(registry) - set(sites):
+            del registry[name]
+    if categories & {'config', 'schedule'}:
+        for config in sites.values():
+            try:
+                get_schedule(config)
+            except Exception as e:
+                logging.error(f"{site_label(config)}Could not load the prayer schedule: {e}")
+    if categories & {'config', 'audio'}:
+        changed = [get_library(config).refresh(config) for config in sites.values()]
+        if any(changed) or 'config' in categories:
+            transcoder.sync(current_config, [
+                track for library in audio_libraries.values()
+                for folder_name in AudioLibrary.FOLDERS for track in library.tracks(folder_name)
+            ])
+
+
+def get_play_time(prayer_time, prayer_name, month):
+    """
+    Returns the instant playback should start: the prayer time itself, or
+    2.5 minutes earlier for the Ramadan Iftar announcement.
+    """
+    if month == 'Ramadan' and prayer_name.lower() == 'maghrib':
+        return prayer_time - timedelta(minutes=2, seconds=30)
+    return prayer_time
+
+# ================================
+# Scheduler
+# ================================
+class Clock:
+    """
+    Wall-clock and monotonic time source for the scheduler.
+    The simulation harness substitutes a virtual clock.
+    """
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+    async def wait(self, event, timeout):
+        """Waits for an asyncio.Event up to timeout seconds; returns True if it was set."""
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+PlannedEvent = namedtuple(
+    'PlannedEvent', 'wake_at play_at site prayer_time prayer_name month devices volume track metadata'
+)
+
+
+def event_label(event):
+    """Log prefix naming a planned event's site in multi-site mode."""
+    return f"[{event.site}] " if event.site else ''
+
+
+def event_key(event):
+    """Identifies a planned event across re-plans: (site, prayer epoch, prayer name)."""
+    return (event.site, event.prayer_time.timestamp(), event.prayer_name)
+
+
+class Scheduler:
+    """
+    asyncio scheduler core.
+    The execution plan holds every site's events for the next plan_horizon
+    seconds, resolved ahead of time (see plan()) and ordered by their
+    pre-warm (wake-up) time. It is rebuilt when an input changes or it runs
+    short, so waking up for an event needs no disk access. The loop
+    sleeps towards the next pre-warm instant in bounded chunks measured on
+    the monotonic clock, re-checking wall time after each chunk so an NTP
+    step or a suspend is corrected instead of oversleeping. Each event is
+    cast in its own task, on a thread pool with a thread per site (see
+    cast_executor()), so playback, discovery and file watching run
+    concurrently with planning the next event and every site starts on
+    time when many fire in the same minute. Events can be skipped or
+    muted (see ControlServer); they still wake the loop but are not cast.
+    """
+    max_sleep = 30  # seconds per sleep chunk
+    horizon = 10  # events read per site when planning
+    plan_horizon = 86400  # seconds of events the plan covers
+    late_tolerance = 300  # seconds after the play time an event may still start
+
+    def __init__(self, clock=None, cast_function=None):
+        self.clock = clock or Clock()
+        self.cast_function = cast_function or cast_announcement_and_athan
+        self._queue = []  # PlannedEvents sorted by wake-up time
+        self._planned_until = 0
+        self._stale = True  # Re-plan on the next pass
+        self._handled = {}  # (site, prayer epoch, prayer name) -> play epoch
+        self._skipped = {}  # (site, prayer epoch, prayer name) -> play epoch
+        self.muted_until = 0  # epoch; events playing before it are not cast
+        self._tasks = set()
+        self._cast_pool = None
+        self._cast_workers = 0
+        self._media_address = None
+        self._loop = None
+        self._replan = None
+
+    def request_replan(self):
+        """Wakes the scheduler to re-plan; safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._replan.set)
+
+    def plan(self, count=None, keep=False):
+        """
+        Builds the execution plan: each site's events for the next plan_horizon
+        seconds (or the next count events of all sites, ignoring the horizon),
+        skipping events already handled. Each event is resolved to its devices,
+        volume, track, media URL, metadata and artwork now, so nothing is read
+        from disk at wake-up. With keep, events already in the plan keep their
+        resolution (used when only the horizon moved, not the inputs).
+        """
+        now = self.clock.time()
+        self._handled = {key: t for key, t in self._handled.items() if t > now - 86400}
+        self._skipped = {key: t for key, t in self._skipped.items() if t > now - 86400}
+        self._queue = self._build(now, count, self._queue if keep else [])
+        self._planned_until = now + self.plan_horizon
+        self._stale = False
+        if self._queue:
+            event = self._queue[0]
+            logging.info(f"{event_label(event)}Next prayer: {event.prayer_name} at {event.prayer_time} during {event.month}")
+
+    def _build(self, now, count, keep, pick_tracks=True):
+        """
+        Returns the planned events from now on, reusing the resolution of
+        those in keep. Without pick_tracks, other events get no track.
+        """
+        previous = {event_key(e): e for e in keep}
+        events = {}
+        for site, config in site_configs(current_config).items():
+            try:
+                upcoming = get_schedule(config).upcoming(now, count or self.horizon)
+            except Exception as e:
+                logging.error(f"{site_label(config)}Could not read the prayer schedule: {e}")
+                continue
+            planned = 0
+            for prayer_name, prayer_time, month in upcoming:
+                key = (site, prayer_time.timestamp(), prayer_name)
+                if key in self._handled or key in events:
+                    continue
+                # Always plan a site's next event, however far away it is
+                if count is None and planned and prayer_time.timestamp() > now + self.plan_horizon:
+                    break
+                events[key] = previous.get(key) or self.resolve(site, config, prayer_name, prayer_time, month, pick_tracks)
+                planned += 1
+        return sorted(events.values(), key=lambda e: (e.wake_at, e.play_at))[:count]
+
+    def upcoming(self, count):
+        """
+        Returns the next count events without changing the plan: planned
+        events as resolved, later ones without a track (it is picked when
+        they are planned).
+        """
+        return self._build(self.clock.time(), count, self._queue, pick_tracks=False)
+
+    def is_planned(self, event):
+        return event_key(event) in {event_key(e) for e in self._queue}
+
+    def is_silenced(self, event):
+        """True if the event was skipped or plays while muted."""
+        return event_key(event) in self._skipped or event.play_at < self.muted_until
+
+    def skip(self, count):
+        """Skips the next count planned events that are not skipped yet; returns them."""
+        skipped = [event for event in self._queue if event_key(event) not in self._skipped][:count]
+        for event in skipped:
+            self._skipped[event_key(event)] = event.play_at
+        return skipped
+
+    def unmute(self):
+        """Cancels the mute and every pending skip."""
+        self.muted_until = 0
+        self._skipped.clear()
+
+    def test_play(self, device_name, prayer_name, site='', month=''):
+        """Casts a prayer's athan to one device right away, alongside the schedule; returns the event."""
+        config = site_configs(current_config)[site]
+        now = self.clock.time()
+        event = self.resolve(site, config, prayer_name, datetime.fromtimestamp(now), month)
+        event = event._replace(wake_at=now, play_at=now, devices=[device_name])
+        if event.track:
+            self._start_event(event)
+        return event
+
+    @staticmethod
+    def resolve(site, config, prayer_name, prayer_time, month, pick_track=True):
+        """Returns the PlannedEvent for one schedule entry of a site (without a track unless pick_track)."""
+        play_at = get_play_time(prayer_time, prayer_name, month).timestamp()
+        track = get_random_athan_file(prayer_name, month, config) if pick_track else None
+        return PlannedEvent(
+            play_at - config['PREWARM_SECONDS'], play_at, site, prayer_time, prayer_name, month,
+            event_devices(prayer_name, month, config), event_volume(prayer_name, config),
+            track, build_media_metadata(track, config) if track else None
+        )
+
+    async def sleep_until(self, target):
+        """
+        Sleeps until the wall-clock epoch target in bounded chunks.
+        Returns False early if a re-plan was requested.
+        """
+        offset = self.clock.time() - self.clock.monotonic()
+        while True:
+            remaining = target - self.clock.time()
+            if remaining <= 0:
+                return True
+            if await self.clock.wait(self._replan, min(remaining, self.max_sleep)):
+                return False
+            # Wall time moving differently from monotonic time means the clock was stepped
+            new_offset = self.clock.time() - self.clock.monotonic()
+            if abs(new_offset - offset) > 1:
+                logging.warning(f"Wall clock jumped by {new_offset - offset:+.1f}s; re-checking the schedule.")
+            offset = new_offset
+
+    def media_address_changed(self):
+        """
+        True if the LAN address in the embedded media server's URLs changed
+        since the last call, e.g. the network came up after the plan was made.
+        """
+        address = None
+        if current_config['MEDIA_SERVER_PORT'] and not current_config['MEDIA_SERVER_URL']:
+            address = local_ip_address()
+        changed, self._media_address = address != self._media_address, address
+        return changed
+
+    def cast_executor(self):
+        """
+        Returns the thread pool for casting. Each event holds a thread for its
+        whole playback, so the pool has one per site plus room for test plays;
+        it is replaced by a larger one when sites are added.
+        """
+        workers = len(site_configs(current_config)) + 2
+        if workers > self._cast_workers:
+            if self._cast_pool is not None:
+                self._cast_pool.shutdown(wait=False)  # Running casts finish on the old threads
+            self._cast_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='event')
+            self._cast_workers = workers
+        return self._cast_pool
+
+    def warm_media_cache(self):
+        """
+        Loads the planned tracks into the media server's cache in the
+        background, soonest last so they are the last to be evicted.
+        """
+        if current_config['MEDIA_SERVER_PORT'] and self._queue:
+            paths = list(dict.fromkeys(e.track.path for e in self._queue if e.track))
+            self._loop.run_in_executor(None, media_server.cache.warm, paths[::-1])
+
+    async def run_event(self, event):
+        """Casts a planned event off the event loop."""
+        config = site_configs(current_config).get(event.site)
+        if config is None:
+            logging.warning(f"Site {event.site} was removed from the configuration. Skipping {event.prayer_name}.")
+            return
+        logging.info(f"{site_label(config)}Waking up...")
+        if not event.track:
+            logging.error(f"{site_label(config)}No audio file available. Skipping this prayer.")
+            return
+        logging.info(f"{site_label(config)}Selected file: {os.path.basename(event.track.path)} "
+                     f"for {event.prayer_name} during {event.month}")
+        await asyncio.get_running_loop().run_in_executor(self.cast_executor(), partial(
+            self.cast_function, event.track, event.devices, event.prayer_name, datetime.fromtimestamp(event.play_at),
+            config, media_metadata=event.metadata, volume=event.volume
+        ))
+
+    def _start_event(self, event):
+        task = asyncio.create_task(self.run_event(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._event_done)
+
+    def _event_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logging.error(f"Unhandled error while casting: {task.exception()}")
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._replan = asyncio.Event()
+        changed_inputs = {'config', 'schedule', 'audio'}
+
+        while True:
+            try:
+                self._replan.clear()
+                changed_inputs |= file_watcher.take_changes()
+                if self.media_address_changed():
+                    changed_inputs.add('audio')  # Media URLs are built on the address
+                if changed_inputs:
+                    await asyncio.to_thread(reload_changed_inputs, changed_inputs)
+                if changed_inputs or self._stale or self.clock.time() + self.plan_horizon / 2 > self._planned_until:
+                    self.plan(keep=not (changed_inputs or self._stale))
+                changed_inputs = set()
+                self.warm_media_cache()
+
+                if not self._queue:
+                    logging.warning("No more prayer times available. Waiting for the schedule to change...")
+                    await self._replan.wait()
+                    self._stale = True
+                    continue
+
+                event = self._queue[0]
+                label = event_label(event)
+                wait_time = timedelta(seconds=round(event.wake_at - self.clock.time()))
+                if event.month == 'Ramadan' and event.prayer_name.lower() == 'maghrib':
+                    logging.info(f"{label}Waiting {wait_time} for Iftar announcement.")
+                else:
+                    logging.info(f"{label}Waiting {wait_time} until {event.prayer_name}.")
+
+                if not await self.sleep_until(event.wake_at):
+                    logging.info("Inputs changed while waiting. Re-planning...")
+                    self._stale = True
+                    continue
+                if self.media_address_changed():
+                    logging.warning(f"LAN address is now {self._media_address}. Re-resolving media URLs...")
+                    changed_inputs.add('audio')
+                    continue
+
+                self._queue.pop(0)
+                self._handled[event_key(event)] = event.play_at
+                late = self.clock.time() - event.play_at
+                if late > self.late_tolerance:
+                    logging.warning(f"{label}Prayer time for {event.prayer_name} passed {late:.0f}s ago. Skipping it.")
+                    metrics.events.inc(result='missed')
+                    continue
+                if self.is_silenced(event):
+                    reason = 'skipped' if event_key(event) in self._skipped else 'muted'
+                    logging.info(f"{label}{event.prayer_name} was {reason} from the control socket. Not casting it.")
+                    metrics.events.inc(result='skipped')
+                    continue
+                self._start_event(event)
+            except Exception as e:
+                logging.error(f"Unhandled error: {e}. Retrying in 60 seconds...")
+                await self.clock.sleep(60)
+
+
+# ================================
+# Control Socket
+# ================================
+RELOAD_CATEGORIES = ('config', 'schedule', 'audio')
+MAX_LISTED_EVENTS = 100
+
+
+def describe_event(event):
+    """Returns the JSON-friendly summary of a planned event."""
+    tz = event.prayer_time.tzinfo
+    return {
+        'site': event.site,
+        'prayer': event.prayer_name,
+        'month': event.month,
+        'prayer_time': event.prayer_time.isoformat(timespec='seconds'),
+        'play_at': datetime.fromtimestamp(event.play_at, tz).isoformat(timespec='seconds'),
+        'wake_at': datetime.fromtimestamp(event.wake_at, tz).isoformat(timespec='seconds'),
+        'devices': list(event.devices),
+        'volume': event.volume,
+        'track': os.path.basename(event.track.path) if event.track else None,
+        'url': event.track.url if event.track else None,
+    }
+
+
+class ControlError(Exception):
+    """A control request that cannot be carried out; its message goes back to the client."""
+
+
+class ControlServer:
+    """
+    Unix domain socket for controlling the running daemon (see
+    tools/athanctl.py). Each request is one JSON object per line with a
+    "command" key and its arguments; each answer is one JSON line with
+    "ok" and either the result or an "error". Commands run on the
+    scheduler's event loop, so they use the warm schedules, audio index,
+    device registry and connections instead of starting a new process.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.started = time.time()
+        self.path = None
+        self._server = None
+        self.commands = {
+            'status': self.status,
+            'next': self.next_events,
+            'test': self.test,
+            'reload': self.reload,
+            'skip': self.skip,
+            'mute': self.mute,
+            'unmute': self.unmute,
+        }
+
+    async def start(self, path):
+        """Listens on path; failures are logged and the daemon runs without the socket."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)  # Left behind by a previous run
+            # Created as 0660 from the start; a chmod after bind leaves a window
+            previous_umask = os.umask(0o117)
+            try:
+                sock.bind(path)
+            finally:
+                os.umask(previous_umask)
+            self._server = await asyncio.start_unix_server(self._handle, sock=sock)
+        except OSError as e:
+            sock.close()
+            logging.warning(f"Control socket unavailable at {path}: {e}")
+            return
+        self.path = path
+        logging.info(f"Control socket listening at {path}")
+
+    def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+    async def _handle(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                writer.write((json.dumps(await self.execute(line)) + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # Client went away or sent an oversized line
+        finally:
+            writer.close()
+
+    async def execute(self, line):
+        """Runs one request line and returns the response dict."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ControlError("request must be a JSON object")
+            command = self.commands.get(request.pop('command', None))
+            if command is None:
+                raise ControlError(f"unknown command; expected one of: {', '.join(self.commands)}")
+            result = command(**request)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return dict(result, ok=True)
+        except (ControlError, ValueError) as e:
+            return {'ok': False, 'error': str(e)}
+        except TypeError as e:  # Unexpected or missing arguments
+            return {'ok': False, 'error': f"bad arguments: {e}"}
+        except Exception as e:
+            logging.error(f"Control request failed: {e}")
+            return {'ok': False, 'error': str(e)}
+
+    def status(self):
+        scheduler = self.scheduler
+        devices = {}
+        for name in sorted(configured_device_names(current_config)):
+            record, state = device_registry.lookup(name), 'discovered'
+            if record is None:
+                record, state = device_registry.cached(name), 'cached'
+            devices[name] = {
+                'state': state if record else 'unknown',
+                'address': f"{record.host}:{record.port}" if record else None,
+            }
+        return {
+            'pid': os.getpid(),
+            'uptime': round(time.time() - self.started),
+            'config_file': CONFIG_FILE,
+            'sites': list(site_configs(current_config)),
+            'next': describe_event(scheduler._queue[0]) if scheduler._queue else None,
+            'planned': len(scheduler._queue),
+            'planned_until': datetime.fromtimestamp(scheduler._planned_until).isoformat(timespec='seconds'),
+            'muted_until': (None if scheduler.muted_until <= scheduler.clock.time()
+                            else 'indefinitely' if scheduler.muted_until == float('inf')
+                            else datetime.fromtimestamp(scheduler.muted_until).isoformat(timespec='seconds')),
+            'skipped': [describe_event(e) for e in scheduler._queue if event_key(e) in scheduler._skipped],
+            'active_casts': len(scheduler._tasks),
+            'devices': devices,
+            'last_event': metrics.recent_events[-1] if metrics.recent_events else None,
+        }
+
+    def next_events(self, count=5):
+        scheduler = self.scheduler
+        events = scheduler.upcoming(min(max(1, int(count)), MAX_LISTED_EVENTS))
+        return {'events': [
+            dict(describe_event(e), planned=scheduler.is_planned(e), silenced=scheduler.is_silenced(e)) for e in events
+        ]}
+
+    def test(self, device, prayer='Dhuhr', site='', month=''):
+        sites = site_configs(current_config)
+        if site not in sites:
+            raise ControlError(f"unknown site {site!r}; configured: {', '.join(sites) or '(default)'}")
+        prayer_name = next((name for name in PRAYER_NAMES if name.lower() == prayer.lower()), None)
+        if prayer_name is None:
+            raise ControlError(f"unknown prayer {prayer!r}; expected one of: {', '.join(PRAYER_NAMES)}")
+        logging.info(f"{site_label(sites[site])}Test {prayer_name} athan on {device} requested from the control socket.")
+        event = self.scheduler.test_play(device, prayer_name, site, month)
+        if not event.track:
+            raise ControlError(f"no audio file available for {prayer_name}")
+        return {'event': describe_event(event)}
+
+    async def reload(self, what='all'):
+        categories = set(RELOAD_CATEGORIES) if what == 'all' else {what}
+        if not categories <= set(RELOAD_CATEGORIES):
+            raise ControlError(f"unknown input {what!r}; expected all or one of: {', '.join(RELOAD_CATEGORIES)}")
+        logging.info(f"Reloading {', '.join(sorted(categories))} on request from the control socket.")
+        await asyncio.to_thread(reload_changed_inputs, categories, True)
+        self.scheduler.request_replan()
+        return {'reloaded': sorted(categories)}
+
+    def skip(self, count=1):
+        skipped = self.scheduler.skip(max(1, int(count)))
+        for event in skipped:
+            logging.info(f"{event_label(event)}{event.prayer_name} at {event.prayer_time} will be skipped.")
+        return {'skipped': [describe_event(e) for e in skipped]}
+
+    def mute(self, minutes=None):
+        scheduler = self.scheduler
+        if minutes is not None:
+            minutes = float(minutes)
+            if not math.isfinite(minutes) or minutes < 0:
+                raise ControlError(f"minutes must be a non-negative number, not {minutes:g}")
+        scheduler.muted_until = float('inf') if minutes is None else scheduler.clock.time() + minutes * 60
+        if minutes is None:
+            logging.info("Muted from the control socket until unmuted.")
+        else:
+            logging.info(f"Muted from the control socket for {minutes:g} minutes.")
+        return self.status()
+
+    def unmute(self):
+        self.scheduler.unmute()
+        logging.info("Unmuted from the control socket; pending skips cancelled.")
+        return self.status()
+
+
+async def run_daemon(scheduler):
+    """
+    Starts the optional media and metrics servers and the control socket, and
+    runs the scheduler until SIGTERM (systemctl stop), which ends it like
+    Ctrl+C so the shutdown runs normally instead of the process being killed.
+    """
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    if current_config['MEDIA_SERVER_PORT']:
+        await media_server.start(current_config['MEDIA_SERVER_PORT'])
+    if current_config['METRICS_PORT']:
+        await metrics.serve(current_config['METRICS_HOST'], current_config['METRICS_PORT'])
+    control = ControlServer(scheduler)
+    if current_config['CONTROL_SOCKET']:
+        await control.start(current_config['CONTROL_SOCKET'])
+    try:
+        await scheduler.run()
+    except asyncio.CancelledError:
+        logging.info("Stop requested. Shutting down...")
+    finally:
+        control.close()
+
+
+def dry_run(count):
+    """Prints the next count planned events, as the daemon would resolve them, without casting."""
+    # Keep the log file for the service; only warnings and errors, on stderr
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_LINE_FORMAT))
+    log_writer.switch_to(handler)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    reload_changed_inputs({'config', 'schedule', 'audio'})
+    scheduler = Scheduler()
+    scheduler.plan(count=count)
+    if not scheduler._queue:
+        print("No upcoming prayer times.")
+    for event in scheduler._queue:
+        print(f"{event_label(event)}{event.prayer_name} at {event.prayer_time:%Y-%m-%d %H:%M:%S %Z} ({event.month})".rstrip())
+        tz = event.prayer_time.tzinfo
+        print(f"    play     {datetime.fromtimestamp(event.play_at, tz):%H:%M:%S}, wake "
+              f"{datetime.fromtimestamp(event.wake_at, tz):%H:%M:%S} ({event.play_at - event.wake_at:g}s pre-warm)")
+        print(f"    devices  {', '.join(event.devices) or '(none configured)'} at volume {event.volume:g}")
+        if not event.track:
+            print("    media    (no audio file available)")
+            continue
+        duration = f", {timedelta(seconds=round(event.track.duration))}" if event.track.duration else ''
+        print(f"    media    {event.track.url} ({event.track.content_type}{duration})")
+        print(f"    title    {event.metadata['title']} - {event.metadata['artist']} ({event.metadata['album']})")
+        print(f"    artwork  {event.metadata['images'][0]['url']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plays the Athan on Chromecast devices at prayer times.")
+    parser.add_argument('--dry-run', type=int, metavar='N',
+                        help="Print the next N planned events (devices, volume, media, artwork) and exit")
+    args = parser.parse_args()
+    if args.dry_run is not None:
+        dry_run(args.dry_run)
+        return
+
+    # Before discovery starts, so devices found right away confirm or correct the cache
+    device_registry.load_cache(current_config['DEVICE_CACHE_FILE'])
+    device_registry.start()
+    file_watcher.set_targets(watch_targets(current_config))
+    file_watcher.start()
+    transcoder.start()
+
+    scheduler = Scheduler()
+    file_watcher.add_listener(scheduler.request_replan)
+    transcoder.add_listener(scheduler.request_replan)
+    try:
+        asyncio.run(run_daemon(scheduler))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        device_registry.stop()
+        if scheduler._cast_pool is not None:
+            scheduler._cast_pool.shutdown(wait=False, cancel_futures=True)
+        logging.info("Athan automation stopped.")
+        log_writer.stop()  # Flush the queued log records before the interpreter exits
+
+
+if __name__ == "__main__":
+    main()
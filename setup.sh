@@ -313,6 +313,12 @@ else
     echo -e "${YELLOW}⚠ Prayer times tools not found, skipping tool installation.${NC}"
 fi
 
+if [ -f tools/athanctl.py ]; then
+    sudo cp tools/athanctl.py "$TOOLS_DIR/"
+    sudo chmod 755 "$TOOLS_DIR/athanctl.py"
+    echo -e "${GREEN}✓ Installed athanctl control client${NC}"
+fi
+
 # 7. Web server installation and configuration
 echo ""
 echo "Checking and configuring web server..."
@@ -354,8 +360,8 @@ SERVICE_FILE="/tmp/athan-automation.service"
 cat > $SERVICE_FILE << EOF
 [Unit]
 Description=Athan Automation Service
-After=network.target time-sync.target
-Wants=time-sync.target
+After=network-online.target time-sync.target
+Wants=network-online.target time-sync.target
 
 [Service]
 User=$USER
@@ -363,6 +369,7 @@ WorkingDirectory=/var/lib/athan-automation
 ExecStart=/usr/local/share/athan-automation/venv/bin/python /usr/local/bin/athan-automation
 Restart=always
 RestartSec=10
+RuntimeDirectory=athan-automation
 StandardOutput=journal
 StandardError=journal
 
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Athan Automation Control Client
+Talks to the running daemon over its control socket (control_socket in the
+configuration), so the warm process answers at once without a restart.
+
+    athanctl.py status
+    athanctl.py next 10
+    athanctl.py test "Living Room speaker" --prayer fajr
+    athanctl.py reload schedule
+    athanctl.py skip
+    athanctl.py mute 90
+    athanctl.py unmute
+
+Only the standard library is used, so the client starts instantly.
+"""
+
+import argparse
+import configparser
+import json
+import os
+import socket
+import sys
+
+CONFIG_FILE = os.environ.get('ATHAN_AUTOMATION_CONFIG', '/etc/athan-automation/config.ini')
+DEFAULT_SOCKET = '/run/athan-automation/control.sock'
+
+
+def default_socket():
+    """Returns control_socket from the daemon's configuration file, or the default path."""
+    cp = configparser.ConfigParser()
+    cp.read(CONFIG_FILE)
+    return os.path.expanduser(cp['DEFAULT'].get('CONTROL_SOCKET', DEFAULT_SOCKET)) or DEFAULT_SOCKET
+
+
+def request(path, command, timeout, **arguments):
+    """Sends one request and returns the daemon's response dict."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.sendall((json.dumps(dict(arguments, command=command)) + '\n').encode('utf-8'))
+        with sock.makefile('rb') as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("the daemon closed the connection without answering")
+    return json.loads(line)
+
+
+def format_event(event):
+    site = f"[{event['site']}] " if event['site'] else ''
+    month = f" ({event['month']})" if event['month'] else ''
+    return f"{site}{event['prayer']} at {event['play_at'].replace('T', ' ')}{month}"
+
+
+def print_event(event, indent='  '):
+    print(f"{indent}{format_event(event)}{'  [silenced]' if event.get('silenced') else ''}")
+    print(f"{indent}    devices {', '.join(event['devices']) or '(none configured)'} at volume {event['volume']:g}")
+    if event['track']:
+        print(f"{indent}    track   {event['track']}")
+    elif event.get('planned', True):
+        print(f"{indent}    track   (no audio file available)")
+    else:
+        print(f"{indent}    track   (picked when the event is planned)")
+
+
+def print_status(response):
+    print(f"Daemon:      pid {response['pid']}, up {response['uptime'] // 3600}h{response['uptime'] // 60 % 60:02d}m, "
+          f"config {response['config_file']}")
+    sites = [site or '(default)' for site in response['sites']]
+    print(f"Sites:       {', '.join(sites)}")
+    print(f"Plan:        {response['planned']} event(s) until {response['planned_until'].replace('T', ' ')}")
+    print(f"Next:        {format_event(response['next']) if response['next'] else 'none'}")
+    muted = response['muted_until']
+    print(f"Muted:       {'no' if muted is None else muted if muted == 'indefinitely' else 'until ' + muted.replace('T', ' ')}")
+    for event in response['skipped']:
+        print(f"Skipping:    {format_event(event)}")
+    print(f"Casting:     {response['active_casts']} event(s) in progress")
+    for name, device in response['devices'].items():
+        address = f" at {device['address']}" if device['address'] else ''
+        print(f"Device:      {name} ({device['state']}{address})")
+    last = response['last_event']
+    if last:
+        site = f"[{last['site']}] " if last['site'] else ''
+        print(f"Last event:  {site}{last['prayer']} at {last['scheduled'].replace('T', ' ')}: {last['result']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control the running athan automation daemon.")
+    parser.add_argument('--socket', help=f"Control socket path (default: control_socket from {CONFIG_FILE})")
+    parser.add_argument('--timeout', type=float, default=10, help="Seconds to wait for the daemon")
+    parser.add_argument('--json', action='store_true', help="Print the raw JSON response")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="Show the daemon's state and next event")
+    next_parser = commands.add_parser('next', help="List the next N events (at most 100)")
+    next_parser.add_argument('count', type=int, nargs='?', default=5)
+    test_parser = commands.add_parser('test', help="Play a test athan on a device now")
+    test_parser.add_argument('device', help="Chromecast friendly name")
+    test_parser.add_argument('--prayer', default='Dhuhr', help="Prayer whose audio and volume to use (default Dhuhr)")
+    test_parser.add_argument('--month', default='', help="Hijri month, e.g. Ramadan with --prayer maghrib for Iftar")
+    test_parser.add_argument('--site', default='', help="Site section in multi-site mode")
+    reload_parser = commands.add_parser('reload', help="Re-read the configuration, schedule and/or audio folders")
+    reload_parser.add_argument('what', nargs='?', default='all', choices=('all', 'config', 'schedule', 'audio'))
+    skip_parser = commands.add_parser('skip', help="Skip the next N events")
+    skip_parser.add_argument('count', type=int, nargs='?', default=1)
+    mute_parser = commands.add_parser('mute', help="Skip every event for MINUTES (default: until unmuted)")
+    mute_parser.add_argument('minutes', type=float, nargs='?')
+    commands.add_parser('unmute', help="Cancel the mute and pending skips")
+    args = parser.parse_args()
+
+    arguments = {
+        'next': lambda: {'count': args.count},
+        'test': lambda: {'device': args.device, 'prayer': args.prayer, 'month': args.month, 'site': args.site},
+        'reload': lambda: {'what': args.what},
+        'skip': lambda: {'count': args.count},
+        'mute': lambda: {'minutes': args.minutes},
+    }.get(args.command, dict)()
+    path = args.socket or default_socket()
+    try:
+        response = request(path, args.command, args.timeout, **arguments)
+    except (OSError, ValueError) as e:
+        print(f"Could not reach the daemon at {path}: {e}", file=sys.stderr)
+        return 2
+
+    if args.json:
+        print(json.dumps(response, indent=2))
+    elif not response['ok']:
+        print(f"Error: {response['error']}", file=sys.stderr)
+    elif args.command in ('status', 'mute', 'unmute'):
+        print_status(response)
+    elif args.command == 'next':
+        for event in response['events']:
+            print_event(event, indent='')
+    elif args.command == 'test':
+        print("Playing:")
+        print_event(response['event'])
+    elif args.command == 'reload':
+        print(f"Reloaded {', '.join(response['reloaded'])}; the plan is rebuilt.")
+    elif args.command == 'skip':
+        print("Skipping:" if response['skipped'] else "Nothing planned to skip.")
+        for event in response['skipped']:
+            print(f"  {format_event(event)}")
+    return 0 if response['ok'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+Fake Chromecast
+A stand-in cast receiver for testing Athan Automation without hardware.
+
+It speaks enough of the Cast v2 protocol (TLS, length-prefixed CastMessage
+protobufs) for pychromecast to connect, launch the Default Media Receiver,
+set the volume, load and play media and follow the playback status, and it
+advertises itself over mDNS so the daemon's discovery finds it by name.
+Buffering and playback durations are configurable:
+
+    fake_chromecast.py --name "Fake speaker" --buffering 0.5 --duration 5
+    fake_chromecast.py --name "Busy speaker" --app CC32E753  # Spotify running
+
+Requires pychromecast and zeroconf (as the daemon does) and the openssl
+command to create a throwaway certificate.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import ssl
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid as uuid_module
+
+from pychromecast.generated.cast_channel_pb2 import CastMessage
+import zeroconf
+
+NS_CONNECTION = 'urn:x-cast:com.google.cast.tp.connection'
+NS_HEARTBEAT = 'urn:x-cast:com.google.cast.tp.heartbeat'
+NS_RECEIVER = 'urn:x-cast:com.google.cast.receiver'
+NS_MEDIA = 'urn:x-cast:com.google.cast.media'
+
+MEDIA_RECEIVER = 'CC1AD845'
+APP_NAMES = {MEDIA_RECEIVER: 'Default Media Receiver', 'CC32E753': 'Spotify', '705D30C6': 'YouTube Music'}
+
+
+def make_certificate(directory):
+    """Creates a self-signed certificate; senders do not verify it."""
+    cert, key = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '3650',
+         '-subj', '/CN=fake-chromecast', '-keyout', key, '-out', cert],
+        check=True, capture_output=True
+    )
+    return cert, key
+
+
+class FakeChromecast:
+    """
+    One fake receiver listening on host:port (port 0 picks a free port).
+    buffering is the delay between LOAD and the media session starting;
+    duration is how long "playback" lasts before the receiver goes IDLE;
+    latency delays every reply like a network round trip. (pychromecast
+    writes to its TLS socket from more than one thread, and replies that
+    arrive instantly over loopback can race and corrupt the stream.)
+    With ignore_autoplay, a LOAD with autoplay off starts playing anyway,
+    as some receivers do.
+    Timestamps of every LOAD/PLAY and of each playback start are kept in
+    events so a test can measure when audio would really have started.
+    """
+
+    def __init__(self, name, host='127.0.0.1', port=0, buffering=0.5, duration=5.0,
+                 model='Google Home Mini', running_app=None, fetch=False, advertise=True, latency=0.01,
+                 ignore_autoplay=False):
+        self.name = name
+        self.ignore_autoplay = ignore_autoplay
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.buffering = buffering
+        self.duration = duration
+        self.model = model
+        self.fetch = fetch
+        self.advertise = advertise
+        self.uuid = uuid_module.uuid4()
+        self.events = []  # (epoch seconds, what, detail)
+        self.volume = 1.0
+        self.muted = False
+        self.app = None
+        self.media = None
+        self._next_session = 1
+        self._clients = {}  # socket -> write lock
+        self._lock = threading.RLock()
+        self._timer = None
+        self._sock = None
+        self._zeroconf = None
+        self._service = None
+        self._tempdir = tempfile.TemporaryDirectory(prefix='fake-chromecast-')
+        if running_app:
+            self._launch(running_app)
+
+    # -- lifecycle -----------------------------------------------------------
+    def start(self, zconf=None):
+        cert, key = make_certificate(self._tempdir.name)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert, key)
+        self._sock = socket.create_server((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._accept, args=(context,), daemon=True, name=f"fake-{self.name}").start()
+        if self.advertise:
+            self._zeroconf = zconf or zeroconf.Zeroconf()
+            self._owns_zeroconf = zconf is None
+            self._service = zeroconf.ServiceInfo(
+                '_googlecast._tcp.local.',
+                f"{self.model.replace(' ', '-')}-{self.uuid.hex}._googlecast._tcp.local.",
+                addresses=[socket.inet_aton(self.host)],
+                port=self.port,
+                properties={'id': self.uuid.hex, 'fn': self.name, 'md': self.model,
+                            've': '05', 'ca': '2052', 'st': '0', 'rs': '', 'nf': '1'},
+                server=f"{self.uuid.hex}.local.",
+            )
+            self._zeroconf.register_service(self._service)
+        logging.info(f"Fake Chromecast '{self.name}' listening on {self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        if self._service:
+            self._zeroconf.unregister_service(self._service)
+            if self._owns_zeroconf:
+                self._zeroconf.close()
+            self._service = None
+        if self._timer:
+            self._timer.cancel()
+        if self._sock:
+            self._sock.close()
+        for client in list(self._clients):
+            client.close()
+        self._tempdir.cleanup()
+
+    @property
+    def cast_info(self):
+        """A pychromecast CastInfo for connecting without discovery."""
+        from pychromecast.models import CastInfo, HostServiceInfo
+        return CastInfo({HostServiceInfo(self.host, self.port)}, self.uuid, self.model, self.name,
+                        self.host, self.port, 'group', 'Google Inc.')
+
+    def playback_starts(self):
+        return [t for t, what, _ in self.events if what == 'playing']
+
+    # -- transport -----------------------------------------------------------
+    def _accept(self, context):
+        while True:
+            try:
+                raw, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(raw, context), daemon=True).start()
+
+    def _serve(self, raw, context):
+        try:
+            client = context.wrap_socket(raw, server_side=True)
+        except (OSError, ssl.SSLError):
+            raw.close()
+            return
+        self._clients[client] = threading.Lock()
+        try:
+            while True:
+                header = self._recv(client, 4)
+                message = CastMessage()
+                message.ParseFromString(self._recv(client, struct.unpack('>I', header)[0]))
+                self._handle(client, message)
+        except (OSError, ConnectionError, ssl.SSLError):
+            pass
+        except Exception:
+            logging.exception(f"Fake Chromecast '{self.name}' failed handling a message")
+        finally:
+            self._clients.pop(client, None)
+            client.close()
+
+    @staticmethod
+    def _recv(client, length):
+        data = b''
+        while len(data) < length:
+            chunk = client.recv(length - len(data))
+            if not chunk:
+                raise ConnectionError("sender closed the connection")
+            data += chunk
+        return data
+
+    def _send(self, client, source, destination, namespace, payload):
+        message = CastMessage()
+        message.protocol_version = message.CASTV2_1_0
+        message.source_id = source
+        message.destination_id = destination
+        message.namespace = namespace
+        message.payload_type = CastMessage.STRING
+        message.payload_utf8 = json.dumps(payload)
+        data = message.SerializeToString()
+        lock = self._clients.get(client)
+        if lock is None:
+            return
+        try:
+            with lock:
+                client.sendall(struct.pack('>I', len(data)) + data)
+        except OSError:
+            pass
+
+    def _broadcast(self, source, namespace, payload, skip=None):
+        for client in list(self._clients):
+            if client is not skip:
+                self._send(client, source, '*', namespace, payload)
+
+    # -- protocol ------------------------------------------------------------
+    def _handle(self, client, message):
+        data = json.loads(message.payload_utf8) if message.payload_utf8 else {}
+        if self.latency:
+            time.sleep(self.latency)
+        kind, request_id = data.get('type'), data.get('requestId', 0)
+        reply = lambda namespace, payload: self._send(
+            client, message.destination_id, message.source_id, namespace, dict(payload, requestId=request_id))
+
+        if message.namespace == NS_HEARTBEAT:
+            if kind == 'PING':
+                self._send(client, message.destination_id, message.source_id, NS_HEARTBEAT, {'type': 'PONG'})
+        elif message.namespace == NS_RECEIVER:
+            with self._lock:
+                if kind == 'LAUNCH':
+                    self._launch(data.get('appId'))
+                elif kind == 'STOP':
+                    self._stop_app()
+                elif kind == 'SET_VOLUME':
+                    self.volume = data['volume'].get('level', self.volume)
+                    self.muted = data['volume'].get('muted', self.muted)
+                status = self._receiver_status()
+            if kind in ('LAUNCH', 'STOP', 'SET_VOLUME'):
+                self.events.append((time.time(), kind.lower(), data.get('appId') or data.get('volume')))
+                # The requester gets the status as its reply; other senders get it unsolicited
+                self._broadcast('receiver-0', NS_RECEIVER, dict(status, requestId=0), skip=client)
+            reply(NS_RECEIVER, status)
+        elif message.namespace == NS_MEDIA and self.app and message.destination_id == self.app['transportId']:
+            if kind in ('LOAD', 'PLAY', 'PAUSE', 'STOP'):
+                self.events.append((time.time(), kind.lower(), data.get('media', {}).get('contentId')))
+            with self._lock:
+                if kind == 'LOAD':
+                    self._load(data)
+                elif kind == 'PLAY' and self.media:
+                    self._play()
+                elif kind == 'PAUSE' and self.media and self.media['playerState'] == 'PLAYING':
+                    self._set_state('PAUSED')
+                elif kind == 'STOP' and self.media:
+                    self._finish('CANCELLED')
+                status = self._media_status()
+            reply(NS_MEDIA, status)
+
+    def _launch(self, app_id):
+        self._stop_app()
+        self.app = {
+            'appId': app_id, 'displayName': APP_NAMES.get(app_id, app_id),
+            'sessionId': str(uuid_module.uuid4()), 'transportId': f"web-{self._next_session}",
+            'namespaces': [{'name': NS_MEDIA}] if app_id == MEDIA_RECEIVER else [],
+            'statusText': 'Ready To Cast', 'isIdleScreen': False,
+        }
+        self._next_session += 1
+
+    def _stop_app(self):
+        if self._timer:
+            self._timer.cancel()
+        self.app, self.media = None, None
+
+    def _receiver_status(self):
+        return {'type': 'RECEIVER_STATUS', 'status': {
+            'volume': {'level': self.volume, 'muted': self.muted, 'controlType': 'attenuation', 'stepInterval': 0.05},
+            'applications': [self.app] if self.app else [],
+            'isActiveInput': True, 'isStandBy': False,
+        }}
+
+    def _media_status(self):
+        if not self.media:
+            return {'type': 'MEDIA_STATUS', 'status': []}
+        media = dict(self.media)
+        if media['playerState'] == 'PLAYING':
+            media['currentTime'] = min(time.time() - media.pop('_started'), self.duration)
+        media = {k: v for k, v in media.items() if not k.startswith('_')}
+        return {'type': 'MEDIA_STATUS', 'status': [media]}
+
+    def _notify_media(self):
+        if self.app:
+            self._broadcast(self.app['transportId'], NS_MEDIA, dict(self._media_status(), requestId=0))
+
+    def _load(self, data):
+        if self._timer:
+            self._timer.cancel()
+        session_id = self._next_session
+        self._next_session += 1
+        self.media = {
+            'mediaSessionId': session_id, 'playbackRate': 1, 'playerState': 'BUFFERING',
+            'currentTime': 0, 'supportedMediaCommands': 274447,
+            'volume': {'level': 1, 'muted': False},
+            'media': dict(data.get('media', {}), duration=self.duration),
+        }
+        autoplay = data.get('autoplay', True)
+        self._timer = threading.Timer(0, self._buffered, args=(session_id, data['media'].get('contentId'), autoplay))
+        self._timer.start()
+
+    def _buffered(self, session_id, url, autoplay):
+        """Runs off the handler thread: waits out buffering (and the optional fetch)."""
+        started = time.monotonic()
+        if self.fetch and url:
+            try:
+                with urllib.request.urlopen(url, timeout=30) as response:
+                    while response.read(65536):
+                        pass
+            except OSError as e:
+                logging.warning(f"Fake Chromecast could not fetch {url}: {e}")
+        time.sleep(max(0, self.buffering - (time.monotonic() - started)))
+        with self._lock:
+            if not self.media or self.media['mediaSessionId'] != session_id:
+                return
+            if autoplay or self.ignore_autoplay:
+                self._play()
+            else:
+                self._set_state('PAUSED')
+
+    def _play(self):
+        self.media['_started'] = time.time() - self.media.get('currentTime', 0)
+        self._set_state('PLAYING')
+        self.events.append((time.time(), 'playing', self.media['media'].get('contentId')))
+        remaining = self.duration - self.media.get('currentTime', 0)
+        self._timer = threading.Timer(max(remaining, 0), self._finished_playing, args=(self.media['mediaSessionId'],))
+        self._timer.start()
+
+    def _finished_playing(self, session_id):
+        with self._lock:
+            if self.media and self.media['mediaSessionId'] == session_id:
+                self._finish('FINISHED')
+
+    def _set_state(self, state):
+        if self.media['playerState'] == 'PLAYING' and state != 'PLAYING':
+            self.media['currentTime'] = time.time() - self.media.pop('_started')
+            if self._timer:
+                self._timer.cancel()
+        self.media['playerState'] = state
+        self._notify_media()
+
+    def _finish(self, reason):
+        self.media['playerState'] = 'IDLE'
+        self.media['idleReason'] = reason
+        self.media.pop('_started', None)
+        self._notify_media()
+        self.events.append((time.time(), 'idle', reason))
+        self.media = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fake Chromecast receivers for testing.")
+    parser.add_argument('--name', action='append', help="Friendly name (repeat for several devices)")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on and advertise")
+    parser.add_argument('--buffering', type=float, default=0.5, help="Seconds from LOAD to playback")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds each playback lasts")
+    parser.add_argument('--latency', type=float, default=0.01, help="Seconds added to every reply")
+    parser.add_argument('--app', help="App id already running at start, e.g. CC32E753 for Spotify")
+    parser.add_argument('--fetch', action='store_true', help="Download the media URL while buffering")
+    parser.add_argument('--ignore-autoplay', action='store_true', help="Start playing even when loaded with autoplay off")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    zconf = zeroconf.Zeroconf()
+    devices = [
+        FakeChromecast(name, args.host, buffering=args.buffering, duration=args.duration,
+                       running_app=args.app, fetch=args.fetch, latency=args.latency,
+                       ignore_autoplay=args.ignore_autoplay).start(zconf)
+        for name in args.name or ['Fake Chromecast']
+    ]
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for device in devices:
+            device.stop()
+        zconf.close()
+
+
+if __name__ == "__main__":
+    main()
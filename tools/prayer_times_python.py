@@ -2,14 +2,76 @@
 """
 Prayer Times Calculator
 Calculates prayer times for a date range and outputs to CSV
+
+Run without arguments for the interactive prompts, or pass the site on the
+command line (or a file of sites) for non-interactive batch generation:
+
+    prayer_times_python.py --latitude 43.65 --longitude -79.38 --method isna \\
+        --start 2025-01-01 --end 2034-12-31 --timezone America/Toronto
+    prayer_times_python.py --sites sites.csv --start 2025-01-01 --end 2034-12-31
+
+--format binary writes the compact binary schedule the service memory-maps
+instead of a CSV, and --convert turns an existing CSV into one:
+
+    prayer_times_python.py --latitude 43.65 --longitude -79.38 --start 2025-01-01 \
+        --end 2054-12-31 --format binary --output prayer_times.bin
+    prayer_times_python.py --convert prayer_times.csv --output prayer_times.bin
 """
 
+import argparse
 import csv
+import json
+import math
+import os
+import re
+import struct
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from praytimes import PrayTimes
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
 from hijridate import Hijri, Gregorian
 
 
+# Calculation method parameters, indexed like the interactive menu
+# These are the standard parameters for each method
+METHOD_PARAMS = {
+    0: {'fajr': 16, 'isha': 14, 'maghrib': '0 min', 'midnight': 'Jafari'},  # Jafari
+    1: {'fajr': 18, 'isha': 18, 'maghrib': '0 min', 'midnight': 'Standard'},  # Karachi
+    2: {'fajr': 15, 'isha': 15, 'maghrib': '0 min', 'midnight': 'Standard'},  # ISNA
+    3: {'fajr': 18, 'isha': 17, 'maghrib': '0 min', 'midnight': 'Standard'},  # MWL
+    4: {'fajr': 18.5, 'isha': '90 min', 'maghrib': '0 min', 'midnight': 'Standard'},  # Makkah
+    5: {'fajr': 19.5, 'isha': 17.5, 'maghrib': '0 min', 'midnight': 'Standard'},  # Egypt
+    6: {'fajr': 17.7, 'isha': 14, 'maghrib': 4.5, 'midnight': 'Jafari'}  # Tehran
+}
+
+# Names accepted for --method and in sites files
+METHOD_NAMES = {
+    'jafari': 0, 'karachi': 1, 'isna': 2, 'mwl': 3, 'makkah': 4, 'egypt': 5, 'tehran': 6
+}
+ASR_NAMES = {'standard': 0, 'shafii': 0, 'hanafi': 1}
+
+PRAYER_NAMES = ['Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']
+
+HIJRI_MONTHS = [
+    "Muharram", "Safar", "Rabi' al-Awwal", "Rabi' al-Thani",
+    "Jumada al-Awwal", "Jumada al-Thani", "Rajab", "Sha'ban",
+    "Ramadan", "Shawwal", "Dhu al-Qi'dah", "Dhu al-Hijjah"
+]
+
+# Binary schedule format (mirrored by BinarySchedule in athan_automation.py):
+# header (magic, version, record size, metadata length, record count), UTF-8
+# JSON metadata padded to 8 bytes, then records sorted by time. A record is
+# the UTC epoch (int64), the prayer code and the Hijri month code; codes
+# index the 'prayers' and 'months' lists in the metadata.
+SCHEDULE_MAGIC = b'ATHANBIN'
+SCHEDULE_VERSION = 1
+SCHEDULE_HEADER = struct.Struct('<8sHHIQ')
+SCHEDULE_RECORD = struct.Struct('<qBB')
+
+
 def get_float_input(prompt, min_val=None, max_val=None):
     """Get validated float input from user"""
     while True:
@@ -53,27 +115,270 @@ def get_choice_input(prompt, options):
             print("Invalid input. Please enter a number.")
 
 
-def get_hijri_month_name(date_obj):
-    """Convert Gregorian date to Hijri and return Arabic month name"""
-    hijri_months = [
-        "Muharram", "Safar", "Rabi' al-Awwal", "Rabi' al-Thani",
-        "Jumada al-Awwal", "Jumada al-Thani", "Rajab", "Sha'ban",
-        "Ramadan", "Shawwal", "Dhu al-Qi'dah", "Dhu al-Hijjah"
-    ]
-    
-    gregorian = Gregorian(date_obj.year, date_obj.month, date_obj.day)
-    hijri = gregorian.to_hijri()
-    return hijri_months[hijri.month - 1]
+# ================================
+# Vectorized prayer time calculation
+# ================================
+# The math follows PrayTimes.org (praytimes 2.3) with one iteration and the
+# default NightMiddle high-latitude rule, evaluated for a whole date range at
+# once with NumPy arrays in UTC; local offsets are applied per day afterwards.
+
+def _param_value(value):
+    """Numeric part of a method parameter (e.g. 18 or '90 min')"""
+    number = re.split('[^0-9.+-]', str(value), 1)[0]
+    return float(number) if number else 0.0
+
+
+def _is_minutes(value):
+    return isinstance(value, str) and 'min' in value
+
+
+def _fix(a, mode):
+    return a - mode * np.floor(a / mode)
+
+
+def _sun_position(jd):
+    """Declination and equation of time for an array of Julian days"""
+    d = jd - 2451545.0
+    g = _fix(357.529 + 0.98560028 * d, 360.0)
+    q = _fix(280.459 + 0.98564736 * d, 360.0)
+    ecliptic = _fix(q + 1.915 * np.sin(np.radians(g)) + 0.020 * np.sin(np.radians(2 * g)), 360.0)
+    e = 23.439 - 0.00000036 * d
+
+    ra = np.degrees(np.arctan2(np.cos(np.radians(e)) * np.sin(np.radians(ecliptic)),
+                               np.cos(np.radians(ecliptic)))) / 15.0
+    eqt = q / 15.0 - _fix(ra, 24.0)
+    decl = np.degrees(np.arcsin(np.sin(np.radians(e)) * np.sin(np.radians(ecliptic))))
+    return decl, eqt
+
 
+def _julian(date_obj):
+    """Julian day of a Gregorian date (Meeus)"""
+    year, month, day = date_obj.year, date_obj.month, date_obj.day
+    if month <= 2:
+        year -= 1
+        month += 12
+    a = math.floor(year / 100)
+    b = 2 - a + math.floor(a / 4)
+    return math.floor(365.25 * (year + 4716)) + math.floor(30.6001 * (month + 1)) + day + b - 1524.5
 
-def get_timezone_offset(date_obj):
-    """Get timezone offset for a specific date (handles DST automatically)"""
-    # Get the local timezone offset including DST
-    timestamp = date_obj.timestamp()
-    local_time = datetime.fromtimestamp(timestamp)
-    utc_time = datetime.utcfromtimestamp(timestamp)
-    offset = (local_time - utc_time).total_seconds() / 3600
-    return offset
+
+def compute_prayer_hours(start_date, n_days, latitude, longitude, params, asr_factor):
+    """
+    Compute prayer times for n_days consecutive days as UTC hours.
+    Returns a dict of prayer key -> float array (NaN where undefined).
+    """
+    jdate = _julian(start_date) + np.arange(n_days) - longitude / (15 * 24.0)
+    lat = np.radians(latitude)
+
+    def mid_day(portion):
+        return _fix(12 - _sun_position(jdate + portion)[1], 24.0)
+
+    def sun_angle_time(angle, portion, ccw=False):
+        decl = np.radians(_sun_position(jdate + portion)[0])
+        noon = mid_day(portion)
+        cos_t = (-np.sin(np.radians(angle)) - np.sin(decl) * np.sin(lat)) / (np.cos(decl) * np.cos(lat))
+        with np.errstate(invalid='ignore'):
+            t = np.degrees(np.arccos(cos_t)) / 15.0
+        return noon - t if ccw else noon + t
+
+    def asr_time(factor, portion):
+        decl = _sun_position(jdate + portion)[0]
+        angle = -np.degrees(np.arctan(1.0 / (factor + np.tan(np.radians(np.abs(latitude - decl))))))
+        return sun_angle_time(angle, portion)
+
+    rise_set_angle = 0.833
+    times = {
+        'fajr': sun_angle_time(_param_value(params['fajr']), 5 / 24.0, ccw=True),
+        'sunrise': sun_angle_time(rise_set_angle, 6 / 24.0, ccw=True),
+        'dhuhr': mid_day(12 / 24.0),
+        'asr': asr_time(asr_factor, 13 / 24.0),
+        'sunset': sun_angle_time(rise_set_angle, 18 / 24.0),
+        'maghrib': sun_angle_time(_param_value(params['maghrib']), 18 / 24.0),
+        'isha': sun_angle_time(_param_value(params['isha']), 18 / 24.0),
+    }
+    times = {name: value - longitude / 15.0 for name, value in times.items()}
+
+    # High latitude adjustment (NightMiddle): clamp to half the night
+    portion = _fix(times['sunrise'] - times['sunset'], 24.0) / 2.0
+    for name, base, ccw in (('fajr', 'sunrise', True), ('isha', 'sunset', False), ('maghrib', 'sunset', False)):
+        diff = _fix(times[base] - times[name], 24.0) if ccw else _fix(times[name] - times[base], 24.0)
+        with np.errstate(invalid='ignore'):
+            clamp = np.isnan(times[name]) | (diff > portion)
+        adjusted = times[base] - portion if ccw else times[base] + portion
+        times[name] = np.where(clamp, adjusted, times[name])
+
+    if _is_minutes(params['maghrib']):
+        times['maghrib'] = times['sunset'] - _param_value(params['maghrib']) / 60.0
+    if _is_minutes(params['isha']):
+        # Isha is a fixed interval after Maghrib (the praytimes Python port subtracts it)
+        times['isha'] = times['maghrib'] + _param_value(params['isha']) / 60.0
+    return times
+
+
+def daily_utc_offsets(tz, start_date, n_days):
+    """
+    UTC offset in hours at local midnight of each day (handles DST).
+    zoneinfo keeps its transition table private, so transitions are located by
+    sampling every two weeks and bisecting only the spans where the offset
+    changes (assumes no two transitions fall within the same two weeks).
+    """
+    cache = {}
+
+    def offset(i):
+        if i not in cache:
+            day = start_date + timedelta(days=i)
+            cache[i] = datetime(day.year, day.month, day.day, tzinfo=tz).utcoffset().total_seconds() / 3600
+        return cache[i]
+
+    offsets = np.full(n_days, offset(0))
+    samples = list(range(0, n_days - 1, 14)) + [n_days - 1]
+    for lo, hi in zip(samples, samples[1:]):
+        start = lo
+        while offset(start) != offset(hi):
+            a, b = start, hi
+            while b - a > 1:
+                mid = (a + b) // 2
+                if offset(mid) == offset(start):
+                    a = mid
+                else:
+                    b = mid
+            offsets[start:b] = offset(start)
+            start = b
+        offsets[start:hi + 1] = offset(hi)
+    return offsets
+
+
+def daily_hijri_months(start_date, n_days):
+    """Hijri month index (0-11) of each day, from one conversion per month boundary"""
+    hijri = Gregorian(start_date.year, start_date.month, start_date.day).to_hijri()
+    year, month = hijri.year, hijri.month
+    months = np.empty(n_days, dtype=np.int8)
+    day = 0
+    while day < n_days:
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        next_start = Hijri(next_year, next_month, 1).to_gregorian()
+        next_day = min((datetime(next_start.year, next_start.month, next_start.day) - start_date).days, n_days)
+        months[day:next_day] = month - 1
+        day, year, month = next_day, next_year, next_month
+    return months
+
+
+def generate_rows(latitude, longitude, method_idx, asr_idx, start_date, end_date, tz):
+    """
+    Yields [Prayer Name, Time and Date, Month] rows for every day in the range.
+    """
+    n_days = (end_date - start_date).days + 1
+    asr_factor = 2 if asr_idx == 1 else 1
+    times = compute_prayer_hours(start_date, n_days, latitude, longitude, METHOD_PARAMS[method_idx], asr_factor)
+    offsets = daily_utc_offsets(tz, start_date, n_days)
+    months = daily_hijri_months(start_date, n_days)
+
+    prayer_keys = ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha']
+    # Local clock minutes, rounded to the nearest minute like praytimes
+    local = np.stack([_fix(times[key] + offsets + 0.5 / 60, 24.0) for key in prayer_keys], axis=1)
+    with np.errstate(invalid='ignore'):
+        minutes = np.floor(local * 60)
+
+    for day in range(n_days):
+        date_str = (start_date + timedelta(days=day)).strftime("%Y-%m-%d")
+        month_name = HIJRI_MONTHS[months[day]]
+        for prayer_name, value in zip(PRAYER_NAMES, minutes[day]):
+            if np.isnan(value):
+                print(f"Warning: {prayer_name} is undefined on {date_str}, skipped", file=sys.stderr)
+                continue
+            hours, mins = divmod(int(value), 60)
+            yield [prayer_name, f"{date_str} {hours:02d}:{mins:02d}:00", month_name]
+
+
+def write_schedule(rows, output):
+    """Streams rows to a CSV file (or stdout for '-'). Returns the number of rows."""
+    count = 0
+    csvfile = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+    try:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Prayer Name', 'Time and Date', 'Month'])
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    finally:
+        if csvfile is not sys.stdout:
+            csvfile.close()
+    return count
+
+
+def write_binary_schedule(rows, output, tz, metadata):
+    """
+    Writes rows as a binary schedule file (or to stdout for '-'). Local times
+    are converted to UTC epochs in tz. The file is written to a temporary name
+    and renamed into place, so a running service never maps a partial file.
+    Returns the number of rows.
+    """
+    prayers, months = list(PRAYER_NAMES), list(HIJRI_MONTHS)
+
+    def code(names, value):
+        if value not in names:
+            if len(names) >= 255:
+                raise ValueError(f"Too many distinct schedule labels (at '{value}')")
+            names.append(value)
+        return names.index(value)
+
+    records = sorted(
+        (int(datetime.fromisoformat(time_str).replace(tzinfo=tz).timestamp()), code(prayers, name), code(months, month))
+        for name, time_str, month in rows
+    )
+    meta = json.dumps(dict(metadata, prayers=prayers, months=months), ensure_ascii=False).encode('utf-8')
+    meta += b' ' * (-(SCHEDULE_HEADER.size + len(meta)) % 8)
+    data = bytearray(SCHEDULE_HEADER.pack(SCHEDULE_MAGIC, SCHEDULE_VERSION, SCHEDULE_RECORD.size, len(meta), len(records)))
+    data += meta
+    for record in records:
+        data += SCHEDULE_RECORD.pack(*record)
+
+    if output == '-':
+        sys.stdout.buffer.write(data)
+        return len(records)
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(output)), prefix='.prayer_times-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, output)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return len(records)
+
+
+def read_schedule_csv(path):
+    """Yields [Prayer Name, Time and Date, Month] rows from a schedule CSV"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            if row.get('Time and Date'):
+                yield [row['Prayer Name'].strip(), row['Time and Date'].strip(), row['Month'].strip()]
+
+
+def load_timezone(name):
+    """ZoneInfo for an IANA name, or the system timezone when name is empty (TZ, then /etc/localtime)"""
+    if name:
+        return ZoneInfo(name)
+    tz = os.environ.get('TZ', '').lstrip(':')
+    try:
+        if tz and not os.path.isabs(tz):
+            return ZoneInfo(tz)
+        with open(tz or '/etc/localtime', 'rb') as f:
+            return ZoneInfo.from_file(f, key=tz or 'localtime')
+    except (OSError, ValueError, ZoneInfoNotFoundError):
+        # e.g. a POSIX TZ rule such as "EST5"; the C library still applies it
+        return datetime.now().astimezone().tzinfo
+
+
+def parse_choice(value, names, label):
+    """Accepts a menu index or a name from names"""
+    value = str(value).strip().lower()
+    if value.isdigit() and int(value) in set(names.values()):
+        return int(value)
+    if value in names:
+        return names[value]
+    raise ValueError(f"Unknown {label} '{value}' (choose from: {', '.join(names)})")
 
 
 def main():
@@ -117,85 +422,174 @@ def main():
         print("Error: End date must be after start date.")
         return
     
-    # Initialize PrayTimes
-    pt = PrayTimes()
-    
-    # Define calculation method parameters manually
-    # These are the standard parameters for each method
-    method_params = {
-        0: {'fajr': 16, 'isha': 14, 'maghrib': '0 min', 'midnight': 'Jafari'},  # Jafari
-        1: {'fajr': 18, 'isha': 18, 'maghrib': '0 min', 'midnight': 'Standard'},  # Karachi
-        2: {'fajr': 15, 'isha': 15, 'maghrib': '0 min', 'midnight': 'Standard'},  # ISNA
-        3: {'fajr': 18, 'isha': 17, 'maghrib': '0 min', 'midnight': 'Standard'},  # MWL
-        4: {'fajr': 18.5, 'isha': '90 min', 'maghrib': '0 min', 'midnight': 'Standard'},  # Makkah
-        5: {'fajr': 19.5, 'isha': 17.5, 'maghrib': '0 min', 'midnight': 'Standard'},  # Egypt
-        6: {'fajr': 17.7, 'isha': 14, 'maghrib': 4.5, 'midnight': 'Jafari'}  # Tehran
-    }
-    
-    # Apply the selected method parameters
-    pt.adjust(method_params[fajr_isha_idx])
-    
-    # Set Asr method (Hanafi uses shadow factor of 2)
-    if asr_idx == 1:  # Hanafi
-        pt.adjust({'asr': 'Hanafi'})
-    
     # Calculate prayer times for date range
     print("\nCalculating prayer times...")
     
-    prayer_data = []
-    prayer_data.append(['Prayer Name','Time and Date','Month'])
-    current_date = start_date
-    
-    while current_date <= end_date:
-        # Get timezone offset for this specific date (handles DST)
-        tz_offset = get_timezone_offset(current_date)
-        
-        # Get prayer times for this date
-        times = pt.getTimes(
-            (current_date.year, current_date.month, current_date.day),
-            (latitude, longitude),
-            tz_offset
-        )
-        
-        # Get Hijri month
-        hijri_month = get_hijri_month_name(current_date)
-        
-        # Format times and add to data
-        date_str = current_date.strftime("%Y-%m-%d")
-        
-        # Extract prayer times in order (excluding sunrise)
-        prayers = ['fajr', 'dhuhr', 'asr', 'maghrib', 'isha']
-        prayer_names = ['Fajr', 'Dhuhr', 'Asr', 'Maghrib', 'Isha']
-        
-        for prayer_key, prayer_name in zip(prayers, prayer_names):
-            time_str = times[prayer_key]
-            # Ensure 24-hour format with proper zero-padding
-            try:
-                # Parse the time (it's already in 24-hour format from praytimes)
-                time_parts = time_str.split(':')
-                hours = int(time_parts[0])
-                minutes = int(time_parts[1])
-                # Format to ensure HH:MM:SS format
-                datetime_str = f"{date_str} {hours:02d}:{minutes:02d}:00"
-            except:
-                datetime_str = f"{date_str} {time_str}:00"
-            
-            prayer_data.append([prayer_name, datetime_str, hijri_month])
-        
-        current_date += timedelta(days=1)
+    rows = generate_rows(latitude, longitude, fajr_isha_idx, asr_idx, start_date, end_date, load_timezone(None))
     
     # Write to CSV
-    with open('prayer_times.csv', 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
-        # No header as per requirements
-        writer.writerows(prayer_data)
+    count = write_schedule(rows, 'prayer_times.csv')
     
-    print(f"\n✓ Successfully calculated {len(prayer_data)} prayer times")
+    print(f"\n✓ Successfully calculated {count} prayer times")
     print(f"  Date range: {start_date.date()} to {end_date.date()}")
     print(f"  Total days: {(end_date - start_date).days + 1}")
 
 
+def run_site(site):
+    """Process pool worker: generate and write the schedule for one site"""
+    tz = load_timezone(site['timezone'])
+    rows = generate_rows(
+        site['latitude'], site['longitude'], site['method'], site['asr'],
+        site['start'], site['end'], tz
+    )
+    if site['format'] == 'binary':
+        metadata = {
+            'site': site['name'], 'latitude': site['latitude'], 'longitude': site['longitude'],
+            'method': next(name for name, idx in METHOD_NAMES.items() if idx == site['method']),
+            'asr': 'hanafi' if site['asr'] == 1 else 'standard',
+            'timezone': str(tz), 'start': f"{site['start']:%Y-%m-%d}", 'end': f"{site['end']:%Y-%m-%d}",
+        }
+        return site['name'], site['output'], write_binary_schedule(rows, site['output'], tz, metadata)
+    return site['name'], site['output'], write_schedule(rows, site['output'])
+
+
+def read_sites(path, defaults):
+    """Reads a CSV file of sites: name,latitude,longitude[,method,asr,timezone,output]"""
+    sites = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            name = row['name'].strip()
+            sites.append({
+                'name': name,
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+                'method': parse_choice(row.get('method') or defaults.method, METHOD_NAMES, 'method'),
+                'asr': parse_choice(row.get('asr') or defaults.asr, ASR_NAMES, 'asr method'),
+                'timezone': row.get('timezone') or defaults.timezone,
+                'output': row.get('output') or os.path.join(defaults.output_dir, f"prayer_times_{name}.{extension(defaults)}"),
+                'format': defaults.format,
+                'start': defaults.start,
+                'end': defaults.end,
+            })
+    return sites
+
+
+def extension(args):
+    return 'bin' if args.format == 'binary' else 'csv'
+
+
+def batch_main(argv):
+    """
+    Non-interactive mode driven by command-line arguments or a sites file.
+    Returns the exit status: 0 when every site was written, 1 otherwise
+    (bad arguments or input exit with status 2 through parser.error).
+    """
+    parser = argparse.ArgumentParser(description="Generate prayer time schedules without prompts.")
+    site = parser.add_mutually_exclusive_group(required=True)
+    site.add_argument('--sites', help="CSV file with columns name,latitude,longitude[,method,asr,timezone,output]")
+    site.add_argument('--latitude', type=float, help="Latitude (-90 to 90)")
+    site.add_argument('--convert', metavar='CSV', help="Convert an existing schedule CSV to the binary format")
+    parser.add_argument('--longitude', type=float, help="Longitude (-180 to 180)")
+    parser.add_argument('--method', default='mwl', help=f"Fajr/Isha method: {', '.join(METHOD_NAMES)} or menu number")
+    parser.add_argument('--asr', default='standard', help="Asr method: standard or hanafi")
+    parser.add_argument('--timezone', help="IANA timezone, e.g. America/Toronto (default: system timezone)")
+    parser.add_argument('--start', type=lambda v: datetime.strptime(v, "%Y-%m-%d"), help="Start date (YYYY-MM-DD)")
+    parser.add_argument('--end', type=lambda v: datetime.strptime(v, "%Y-%m-%d"), help="End date (YYYY-MM-DD)")
+    parser.add_argument('--format', choices=('csv', 'binary'), default='csv',
+                        help="csv, or binary for the memory-mapped schedule format")
+    parser.add_argument('--output', help="Output file for a single site ('-' for stdout; default prayer_times.csv/.bin)")
+    parser.add_argument('--output-dir', default='.', help="Directory for per-site outputs from --sites")
+    parser.add_argument('--workers', type=int, default=None, help="Processes for --sites (default: CPU count)")
+    args = parser.parse_args(argv)
+
+    try:
+        tz = load_timezone(args.timezone)
+    except (ValueError, ZoneInfoNotFoundError):
+        parser.error(f"Unknown timezone '{args.timezone}'")
+
+    if args.convert:
+        # Times in the CSV are local to --timezone (default: system timezone)
+        output = args.output or os.path.splitext(args.convert)[0] + '.bin'
+        metadata = {'source': os.path.basename(args.convert), 'timezone': str(tz)}
+        try:
+            count = write_binary_schedule(read_schedule_csv(args.convert), output, tz, metadata)
+        except KeyError as e:
+            parser.error(f"Missing column {e} in {args.convert}")
+        except (OSError, ValueError) as e:
+            parser.error(f"Cannot convert {args.convert}: {e}")
+        print(f"✓ {count} prayer times converted to {output}", file=sys.stderr)
+        return 0
+
+    if args.start is None or args.end is None:
+        parser.error("--start and --end are required")
+    if args.end < args.start:
+        parser.error("End date must be after start date.")
+    args.output = args.output or f"prayer_times.{extension(args)}"
+
+    try:
+        if args.sites:
+            sites = read_sites(args.sites, args)
+        else:
+            if args.longitude is None:
+                parser.error("--longitude is required with --latitude")
+            sites = [{
+                'name': 'site', 'latitude': args.latitude, 'longitude': args.longitude,
+                'method': parse_choice(args.method, METHOD_NAMES, 'method'),
+                'asr': parse_choice(args.asr, ASR_NAMES, 'asr method'),
+                'timezone': args.timezone, 'output': args.output, 'format': args.format,
+                'start': args.start, 'end': args.end,
+            }]
+    except OSError as e:
+        parser.error(f"Cannot read {args.sites}: {e}")
+    except KeyError as e:
+        parser.error(f"Missing column {e} in {args.sites}")
+    except ValueError as e:
+        parser.error(str(e))
+    if not sites:
+        parser.error(f"No sites listed in {args.sites}")
+    for entry in sites:
+        if not (-90 <= entry['latitude'] <= 90 and -180 <= entry['longitude'] <= 180):
+            parser.error(f"Invalid coordinates for site {entry['name']}")
+        try:
+            load_timezone(entry['timezone'])
+        except (ValueError, ZoneInfoNotFoundError):
+            parser.error(f"Unknown timezone '{entry['timezone']}' for site {entry['name']}")
+
+    # A failing site is reported without discarding the others' results
+    failures = 0
+    if len(sites) == 1:
+        outcomes = [(sites[0], run_or_error(sites[0]))]
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [(entry, pool.submit(run_site, entry)) for entry in sites]
+            outcomes = [(entry, future.exception() or future.result()) for entry, future in futures]
+    for entry, outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            print(f"✗ {entry['name']}: {outcome}", file=sys.stderr)
+            failures += 1
+            continue
+        name, output, count = outcome
+        if output != '-':
+            print(f"✓ {name}: {count} prayer times written to {output}", file=sys.stderr)
+    if failures:
+        print(f"{failures} of {len(sites)} site(s) failed", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def run_or_error(site):
+    """Runs one site in this process; returns its result or the exception it raised"""
+    try:
+        return run_site(site)
+    except Exception as e:
+        return e
+
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        try:
+            sys.exit(batch_main(sys.argv[1:]))
+        except KeyboardInterrupt:
+            sys.exit(130)
     try:
         main()
     except KeyboardInterrupt:
@@ -204,3 +598,4 @@ if __name__ == "__main__":
         print(f"\nError: {e}")
         import traceback
         traceback.print_exc()
+        sys.exit(1)
@@ -12,7 +12,7 @@ echo
 # --- Configuration Variables ---
 VENV_PATH="/usr/local/share/athan-automation/venv"
 FINAL_DESTINATION="/var/lib/athan-automation/prayer_times.csv"
-REQUIRED_PACKAGES=("praytimes" "hijridate")
+REQUIRED_PACKAGES=("numpy" "hijridate")
 
 # --- Function to check for required binaries in VENV ---
 
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Athan Automation Simulator
+Replays a prayer times CSV through the daemon's real scheduler on a virtual
+clock, so months of prayers run in seconds, and reports a benchmark:
+scheduler wake lateness percentiles, missed events, CPU time and peak RSS.
+
+The replay records when each event is handed to the cast function instead
+of casting. Start drift is only measured with --live: that many events are
+then cast for real, in real time, through the daemon's casting code to
+fake Chromecasts on this machine (see fake_chromecast.py), and the start
+offset is taken at the receiver.
+
+    simulate.py --schedule examples/prayer_times_SAMPLE.csv
+    simulate.py --schedule prayer_times.csv --load-ms 400 --live 3
+"""
+
+import argparse
+import asyncio
+import importlib.machinery
+import importlib.util
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DAEMON = next(
+    (path for path in (os.path.join(TOOLS_DIR, '..', 'athan_automation.py'), '/usr/local/bin/athan-automation')
+     if os.path.exists(path)),
+    None
+)
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz): 417 bytes, ~26 ms
+SILENT_FRAME = b'\xff\xfb\x90\x00' + bytes(413)
+
+
+def write_silent_mp3(path, seconds):
+    with open(path, 'wb') as f:
+        f.write(SILENT_FRAME * int(seconds * 44100 / 1152))
+
+
+def prepare_sandbox(directory, schedule, prewarm, devices):
+    """Creates audio folders and a config file for the daemon under directory."""
+    for folder in ('fajr', 'prayer', 'iftar'):
+        os.makedirs(os.path.join(directory, folder), exist_ok=True)
+        write_silent_mp3(os.path.join(directory, folder, f"{folder}.mp3"), 2)
+    config_file = os.path.join(directory, 'config.ini')
+    with open(config_file, 'w') as f:
+        f.write(
+            "[DEFAULT]\n"
+            f"fajr_folder = {directory}/fajr\n"
+            f"prayer_folder = {directory}/prayer\n"
+            f"iftar_folder = {directory}/iftar\n"
+            f"prayer_times_file = {os.path.abspath(schedule)}\n"
+            f"log_file = {directory}/athan.log\n"
+            f"event_log_file = {directory}/events.jsonl\n"
+            f"device_cache_file = {directory}/devices.json\n"
+            f"athan_device = {', '.join(devices)}\n"
+            f"iftar_device = {', '.join(devices)}\n"
+            f"prewarm_seconds = {prewarm}\n"
+            "lighttpd_base_url = http://127.0.0.1:9/athan\n"
+        )
+    return config_file
+
+
+def load_daemon(path, config_file):
+    """Imports the daemon script as a module using the sandbox configuration."""
+    os.environ['ATHAN_AUTOMATION_CONFIG'] = config_file
+    loader = importlib.machinery.SourceFileLoader('athan_automation', path)
+    spec = importlib.util.spec_from_loader('athan_automation', loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def percentiles(values, points=(50, 90, 99, 100)):
+    ordered = sorted(values)
+    if not ordered:
+        return {p: None for p in points}
+    return {p: ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] for p in points}
+
+
+def format_percentiles(label, values, unit='ms', scale=1000):
+    stats = percentiles(values)
+    if stats[50] is None:
+        return f"{label:<28} n/a"
+    text = '  '.join(f"p{p if p < 100 else 'max'} {stats[p] * scale:8.1f}" for p in stats)
+    return f"{label:<28} {text} {unit}"
+
+
+def make_virtual_clock(daemon):
+    class VirtualClock(daemon.Clock):
+        """
+        Virtual time for the scheduler. Time only moves when the scheduler
+        sleeps or waits, and only once the casts it started have returned, so
+        a run is deterministic and as fast as the scheduler's own work.
+        """
+
+        def __init__(self, start):
+            self.now = start
+            self.busy = lambda: False
+
+        def time(self):
+            return self.now
+
+        def monotonic(self):
+            return self.now
+
+        async def _settle(self):
+            while self.busy():
+                await asyncio.sleep(0.0005)
+            await asyncio.sleep(0)
+
+        async def sleep(self, seconds):
+            await self._settle()
+            self.now += seconds
+
+        async def wait(self, event, timeout):
+            await self._settle()
+            if event.is_set():
+                return True
+            self.now += timeout
+            return event.is_set()
+
+    return VirtualClock
+
+
+class CastRecorder:
+    """
+    Stand-in for cast_announcement_and_athan on the virtual clock: records
+    how late after its pre-warm instant the scheduler handed over each event.
+    """
+
+    def __init__(self, clock, prewarm):
+        self.clock = clock
+        self.prewarm = prewarm
+        self.lateness = []
+
+    def __call__(self, track, device_names, prayer_name, play_at=None, config=None, media_metadata=None, volume=None):
+        self.lateness.append(self.clock.time() - (play_at.timestamp() - self.prewarm))
+
+
+async def run_virtual(daemon, args):
+    """Runs the scheduler over the whole schedule on the virtual clock."""
+    index = daemon.get_schedule(daemon.current_config)
+    first = index.next_event(0)
+    if first is None:
+        raise SystemExit(f"No prayer times in {args.schedule}")
+    start = first[1].timestamp() - 3600
+    events = index.upcoming(start, len(index))
+    prayer_name, prayer_time, month = events[-1]
+    last_play_at = daemon.get_play_time(prayer_time, prayer_name, month).timestamp()
+
+    clock = make_virtual_clock(daemon)(start)
+    recorder = CastRecorder(clock, args.prewarm)
+    scheduler = daemon.Scheduler(clock=clock, cast_function=recorder)
+    clock.busy = lambda: bool(scheduler._tasks)
+
+    task = asyncio.create_task(scheduler.run())
+    # Done once the last event's wake-up has passed and nothing is queued or running
+    while not (clock.now >= last_play_at - args.prewarm and not scheduler._queue and not scheduler._tasks):
+        await asyncio.sleep(0.01)
+    task.cancel()
+    return len(events), clock.now - start, recorder
+
+
+def run_live(daemon, args):
+    """Casts a few events in real time to fake Chromecasts; returns receiver-side start offsets."""
+    sys.path.insert(0, TOOLS_DIR)
+    from fake_chromecast import FakeChromecast
+
+    devices = [
+        FakeChromecast(name, buffering=args.load_ms / 1000, duration=args.live_duration).start(daemon.device_registry.zconf)
+        for name in daemon.current_config['ATHAN_DEVICE']
+    ]
+    offsets = []
+    try:
+        for _ in range(args.live):
+            track = daemon.get_random_athan_file('Dhuhr', 'Rajab')
+            scheduled = time.time() + args.prewarm
+            daemon.cast_announcement_and_athan(track, daemon.current_config['ATHAN_DEVICE'], 'Dhuhr',
+                                               datetime.fromtimestamp(scheduled))
+            for device in devices:
+                starts = [t for t in device.playback_starts() if t >= scheduled - args.prewarm]
+                if starts:
+                    offsets.append(starts[-1] - scheduled)
+    finally:
+        for device in devices:
+            device.stop()
+    return offsets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a prayer schedule through the daemon and report timing.")
+    parser.add_argument('--schedule', default=os.path.join(TOOLS_DIR, '..', 'examples', 'prayer_times_SAMPLE.csv'),
+                        help="Prayer times CSV or binary schedule to replay")
+    parser.add_argument('--daemon', default=DEFAULT_DAEMON, help="Path to the athan automation script")
+    parser.add_argument('--devices', type=int, default=2, help="Number of simulated devices")
+    parser.add_argument('--prewarm', type=int, default=60, help="prewarm_seconds for the run")
+    parser.add_argument('--load-ms', type=float, default=500, help="Fake Chromecasts' time from load to audio (--live)")
+    parser.add_argument('--live', type=int, default=0, help="Also cast this many events to fake Chromecasts in real time")
+    parser.add_argument('--live-duration', type=float, default=2.0, help="Playback length on the fake Chromecasts")
+    args = parser.parse_args()
+    if not args.daemon:
+        parser.error("athan automation script not found; pass --daemon")
+
+    with tempfile.TemporaryDirectory(prefix='athan-sim-') as directory:
+        devices = [f"Simulated speaker {i + 1}" for i in range(args.devices)]
+        config_file = prepare_sandbox(directory, args.schedule, args.prewarm, devices)
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        daemon = load_daemon(args.daemon, config_file)
+        import_time = time.perf_counter() - wall
+        expected, simulated, recorder = asyncio.run(run_virtual(daemon, args))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        live_offsets = []
+        if args.live:
+            daemon.device_registry.start()
+            try:
+                live_offsets = run_live(daemon, args)
+            finally:
+                daemon.device_registry.stop()
+
+    cast = len(recorder.lateness)
+    print(f"Schedule:                    {args.schedule}")
+    print(f"Events:                      {cast} cast of {expected} ({expected - cast} missed)")
+    run_time = wall - import_time
+    print(f"Simulated time:              {simulated / 86400:.1f} days in {run_time:.2f}s "
+          f"({simulated / max(run_time, 1e-9):,.0f}x real time)")
+    print(format_percentiles("Scheduler wake lateness", recorder.lateness))
+    if args.live:
+        print(format_percentiles(f"Start drift (live, n={len(live_offsets)})", live_offsets))
+    print(f"Import time:                 {import_time * 1000:.0f} ms")
+    print(f"CPU time (import + replay):  {cpu:.2f}s")
+    print(f"Peak RSS:                    {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+    return 0 if cast == expected else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
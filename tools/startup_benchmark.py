@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Athan Automation Startup Benchmark
+Measures the daemon's cold start in fresh interpreters: time to import the
+script (config + logging), time until the first event is planned (schedule
+indexed, audio folders scanned), process wall time and peak RSS, and lists
+which heavy dependencies got imported on the way.
+
+    startup_benchmark.py
+    startup_benchmark.py --runs 10 --max-ready-ms 800 --max-rss-mb 40
+
+With --max-* limits the exit status is 1 when the median exceeds one, so it
+can gate changes that slow down startup.
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_DIR)
+from simulate import DEFAULT_DAEMON, load_daemon, prepare_sandbox  # noqa: E402
+
+HEAVY_MODULES = ('pychromecast', 'zeroconf', 'mutagen', 'praytimes', 'hijridate', 'pandas', 'numpy', 'requests')
+
+
+def measure(daemon_path, config_file):
+    """Runs in the child interpreter: imports the daemon and plans the first event."""
+    started = time.perf_counter()
+    daemon = load_daemon(daemon_path, config_file)
+    imported = time.perf_counter()
+    daemon.reload_changed_inputs({'config', 'schedule', 'audio'})
+    # Plan from just before the first entry so a past schedule still yields events
+    first = daemon.get_schedule(daemon.current_config).next_event(0)
+    clock = daemon.Clock()
+    if first is not None:
+        clock.time = lambda: first[1].timestamp() - 3600
+    scheduler = daemon.Scheduler(clock=clock)
+    scheduler.plan()
+    ready = time.perf_counter()
+    return {
+        'import_ms': (imported - started) * 1000,
+        'ready_ms': (ready - started) * 1000,
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'planned': len(scheduler._queue),
+        'modules': sorted(name for name in HEAVY_MODULES if name in sys.modules),
+    }
+
+
+def run_child(args, config_file):
+    started = time.perf_counter()
+    result = subprocess.run(
+        [args.python, os.path.abspath(__file__), '--child', config_file, '--daemon', args.daemon],
+        check=True, capture_output=True, text=True
+    )
+    sample = json.loads(result.stdout.strip().splitlines()[-1])
+    sample['process_ms'] = (time.perf_counter() - started) * 1000
+    return sample
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the athan automation daemon's cold start time and memory.")
+    parser.add_argument('--schedule', default=os.path.join(TOOLS_DIR, '..', 'examples', 'prayer_times_SAMPLE.csv'),
+                        help="Prayer times CSV or binary schedule used for the run")
+    parser.add_argument('--daemon', default=DEFAULT_DAEMON, help="Path to the athan automation script")
+    parser.add_argument('--python', default=sys.executable, help="Interpreter to benchmark (e.g. the service's venv)")
+    parser.add_argument('--runs', type=int, default=5, help="Number of fresh interpreters to start")
+    parser.add_argument('--max-import-ms', type=float, default=0, help="Fail if the median import time exceeds this")
+    parser.add_argument('--max-ready-ms', type=float, default=0, help="Fail if the median time to first plan exceeds this")
+    parser.add_argument('--max-rss-mb', type=float, default=0, help="Fail if the median peak RSS exceeds this")
+    parser.add_argument('--child', metavar='CONFIG', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if not args.daemon:
+        parser.error("athan automation script not found; pass --daemon")
+
+    if args.child:
+        print(json.dumps(measure(args.daemon, args.child)))
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix='athan-startup-') as directory:
+        config_file = prepare_sandbox(directory, args.schedule, 60, ['Simulated speaker'])
+        samples = [run_child(args, config_file) for _ in range(args.runs)]
+
+    print(f"Interpreter:                 {args.python}")
+    print(f"Runs:                        {len(samples)} ({samples[0]['planned']} events planned)")
+    failed = False
+    for key, label, unit, limit in (
+        ('import_ms', "Import", 'ms', args.max_import_ms),
+        ('ready_ms', "Ready (first event planned)", 'ms', args.max_ready_ms),
+        ('process_ms', "Process wall time", 'ms', 0),
+        ('rss_mb', "Peak RSS", 'MB', args.max_rss_mb),
+    ):
+        values = [sample[key] for sample in samples]
+        median = statistics.median(values)
+        verdict = ''
+        if limit:
+            verdict = f"  (limit {limit:g} {unit}: {'FAIL' if median > limit else 'ok'})"
+            failed = failed or median > limit
+        print(f"{label + ':':<28} median {median:8.1f}  min {min(values):8.1f}  max {max(values):8.1f} {unit}{verdict}")
+    print(f"Heavy modules loaded:        {', '.join(samples[0]['modules']) or 'none'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())